@@ -1,5 +1,7 @@
 from otree.api import *
-import random
+
+from common import core, export, instrument, monitor, payoffs
+from common.flow import Page, WaitPage #skip hidden pages in one step
 
 doc = """
 This is a one-shot "Prisoner's Dilemma". Two players are asked separately
@@ -10,7 +12,7 @@ payoffs.
 
 class C(BaseConstants):
     NAME_IN_URL = 'asypay_asyvote'
-    PLAYERS_PER_GROUP = 4
+    PLAYERS_PER_GROUP = None #groups are formed in creating_session, see GROUP_SIZE
     NUM_ROUNDS = 2
     VOTE_ROUND = NUM_ROUNDS/2 + 1
     PAYOFF_DC_L = cu(60)
@@ -31,14 +33,18 @@ class C(BaseConstants):
 
     COST_VOTING = cu(10)
 
+    GROUP_SIZE = 4 #default for the players_per_group session config
+    PAIRING = 'random' #default for the pairing session config, 'random' or 'fixed'
+    NUM_RICH = 2 #rich players per group, default for the rich_per_group session config
+    VOTE_SCHEME = 'equal' #one vote per player
+    TRACK_HISTORY = False #no history tables in this app
+
+
+PAYOFF_TABLE = payoffs.build_payoff_table(C)
+
 
 class Subsession(BaseSubsession):
     pass
-    # def creating_session(subsession):
-    #     if subsession.round_number == 1:
-    #         subsession.group_randomly() #randomly group subjects in round 1
-    #     else:
-    #         subsession.group_like_round(1) #keep the same group structure as round 1
 
 
 class Group(BaseGroup):
@@ -46,6 +52,9 @@ class Group(BaseGroup):
     total_if_vote = models.IntegerField()
     if_override = models.BooleanField() #whether computer overrides the group decision
     dice = models.BooleanField() #if computer overrides group decision, whether it is exoYES or exoNo
+    pairing = models.StringField() #partner's id_in_group for each player in this round, e.g. '3,4,1,2'
+    coin_flips = models.IntegerField() #vote round only: override and dice bits drawn in creating_session
+    barriers = models.StringField(initial='') #wait page callbacks that have run, see common/barrier.py
 
 
 class Player(BasePlayer):
@@ -60,146 +69,42 @@ class Player(BasePlayer):
 
     if_vote = models.BooleanField(widget=widgets.RadioSelectHorizontal(),
                                   label='Do you want to vote for a cooperation game?')
-    additional_vote_share = models.IntegerField(label='How many additional share(s) you want to buy? (up to 9)', max=9,)
+    additional_vote_share = models.IntegerField(label='How many additional share(s) you want to buy? (up to 9)', min=0, max=9,)
     individual_total_shares = models.IntegerField() #how many shares each have
 
 
 # FUNCTIONS
-def assign_role(group:Group):
-    rich = random.sample(group.get_players(), 2) #randomly choose two players as a pair in group A
-    poor = []
-    for p in group.get_players():
-        if p not in rich:
-            poor.append(p) #leave the rest of two as a pair in group B
-            p.player_role = 'poor'
-        else:
-            p.player_role = 'rich'
-
-
-def random_match_in_pairs(group:Group):
-    group1 = random.sample(group.get_players(), 2) #randomly choose two players as a pair in group A
-    group2 = []
-    for p in group.get_players():
-        if p not in group1:
-            group2.append(p) #leave the rest of two as a pair in group B
-            p.subgroup = 'B'
-        else:
-            p.subgroup = 'A'
-    if group.round_number > 1:
-        for p in group.get_players():
-            p.player_role = p.in_round(p.round_number - 1).player_role
-
-# def assign_same_role(group: Group):
-#     for p in group.get_players():
-#         p.player_role = p.in_round(p.round_number - 1)
+def creating_session(subsession: Subsession):
+    core.creating_session(subsession, C)
+
 
 def set_payoffs(group: Group):
-    for p in group.get_players():
-        set_payoff(p)
-
-
-#get opponent id
-def other_player(player: Player):
-    for p in player.get_others_in_group():
-        if p.subgroup == player.subgroup:
-            player.opponent_id = p.id_in_group
-    return player.opponent_id
-
-
-def set_payoff(player: Player):
-    payoff_matrix_h = {
-        (False, True): C.PAYOFF_DC_H,
-        (True, True): C.PAYOFF_CC_H,
-        (False, False): C.PAYOFF_DD_H,
-        (True, False): C.PAYOFF_CD_H,
-    }
-
-    payoff_matrix_l = {
-        (False, True): C.PAYOFF_DC_L,
-        (True, True): C.PAYOFF_CC_L,
-        (False, False): C.PAYOFF_DD_L,
-        (True, False): C.PAYOFF_CD_L,
-    }
-    payoff_matrix_cooperate_h = {
-        (False, True): C.PAYOFF_DC_COOPERATE_H,
-        (True, True): C.PAYOFF_CC_H,
-        (False, False): C.PAYOFF_DD_H,
-        (True, False): C.PAYOFF_CD_H,
-    }
-
-    payoff_matrix_cooperate_l = {
-        (False, True): C.PAYOFF_DC_COOPERATE_L,
-        (True, True): C.PAYOFF_CC_L,
-        (False, False): C.PAYOFF_DD_L,
-        (True, False): C.PAYOFF_CD_L,
-    }
-    other = player.group.get_player_by_id(other_player(player))
-    if player.round_number < C.VOTE_ROUND:
-        if player.player_role == 'rich':
-            player.payoff = payoff_matrix_h[(player.cooperate, other.cooperate)]
-        else:
-            player.payoff = payoff_matrix_l[(player.cooperate, other.cooperate)]
-    else:
-        if player.group.treatment == 'exoNo' or 'endoNo':
-            if player.player_role == 'rich':
-                player.payoff = payoff_matrix_h[(player.cooperate, other.cooperate)]
-            else:
-                player.payoff = payoff_matrix_l[(player.cooperate, other.cooperate)]
-        else:
-            if player.player_role == 'rich':
-                player.payoff = payoff_matrix_cooperate_h[(player.cooperate, other.cooperate)]
-            else:
-                player.payoff = payoff_matrix_cooperate_l[(player.cooperate, other.cooperate)]
+    core.set_payoffs(group, C, PAYOFF_TABLE)
 
 
 def assign_treatment(group: Group):
-    players = group.get_players()
-    group_if_vote = [p.if_vote for p in players]
-    group.total_if_vote = sum(group_if_vote)
-    if group.total_if_vote > C.PLAYERS_PER_GROUP/2:
-        group.treatment = 'EndoYes'
-    elif group.total_if_vote < C.PLAYERS_PER_GROUP/2:
-        group.treatment = 'EndoNo'
-    else:
-        group.treatment = 'tie'
-    computer_control = random.choices([1,0], weights=[1,1], k=1)
-    if computer_control[0] == 1:
-        group.if_override = 1
-        dice = random.choices([1,0], weights=[1,1], k=1)
-        if dice[0] == 1:
-            group.dice = 1
-            group.treatment = 'ExoYes'
-        else:
-            group.dice = 0
-            group.treatment = 'ExoNo'
-    else:
-        group.if_override = 0
-
-    if (group.treatment == 'tie') and (group.if_override == 0): #special case where a tie and not overriden by computer, computer randomly choose yes or no
-        dice = random.choices([1, 0], weights=[1, 1], k=1)
-        if dice[0] == 1:
-            group.dice = 1
-            group.treatment = 'EndoYes'
-        else:
-            group.dice = 0
-            group.treatment = 'EndoNo'
+    core.assign_treatment(group, C)
 
 
+def custom_export(players):
+    #one tidy row per player-round, generated lazily; see common/export.py for the streaming CLI
+    yield from export.tidy_rows(players, Player, Group)
 
-# PAGES
-class OverallIntro(Page):
-    @staticmethod
-    def is_displayed(player):
-        return player.round_number == 1
 
+def vars_for_admin_report(subsession: Subsession):
+    return dict(
+        monitor.admin_report_vars(subsession.session, C.NAME_IN_URL),
+        **instrument.admin_report_vars(C.NAME_IN_URL),
+    )
 
-class AssignRoleWaitPage(WaitPage):
-    after_all_players_arrive = assign_role
 
+# PAGES
+class OverallIntro(Page):
     @staticmethod
     def is_displayed(player):
         return player.round_number == 1
 
+
 class IntroductionRich(Page):
     @staticmethod
     def is_displayed(player):
@@ -241,61 +146,46 @@ class VoteResult(Page):
 class IntroductionRichCooperate(Page):
     @staticmethod
     def is_displayed(player):
-        return (player.round_number == C.VOTE_ROUND+1) and (player.group.treatment == 'endoYES' or 'exoYES') and (player.player_role == 'rich')
+        return (player.round_number == C.VOTE_ROUND+1) and (core.part2_game(player.group.treatment) == payoffs.GAME_B) and (player.player_role == 'rich')
 
 class IntroductionPoorCooperate(Page):
     @staticmethod
     def is_displayed(player):
-        return (player.round_number == C.VOTE_ROUND+1) and (player.group.treatment == 'endoYES' or 'exoYES') and (player.player_role == 'poor')
+        return (player.round_number == C.VOTE_ROUND+1) and (core.part2_game(player.group.treatment) == payoffs.GAME_B) and (player.player_role == 'poor')
 
-class MatchInPairsWaitPage(WaitPage):
-    after_all_players_arrive = random_match_in_pairs
-    # after_all_players_arrive = assign_same_role
-
-class Decision(Page):
-    form_model = 'player'
-    form_fields = ['cooperate']
+class Decision(core.DecisionPage):
+    constants = C
+    payoff_table = PAYOFF_TABLE
 
     @staticmethod
     def is_displayed(player):
         return player.round_number < C.VOTE_ROUND
 
-    @staticmethod
-    def vars_for_template(player: Player):
-        opponent = player.group.get_player_by_id(other_player(player))
-        return dict(
-            opponent=opponent,
-            opponent_role=opponent.player_role,
-        )
 
-
-class DecisionAfterVote(Page):
-    form_model = 'player'
-    form_fields = ['cooperate']
+class DecisionAfterVote(core.DecisionPage):
+    constants = C
+    payoff_table = PAYOFF_TABLE
 
     @staticmethod
     def is_displayed(player):
         return player.round_number >= C.VOTE_ROUND
 
-    @staticmethod
-    def vars_for_template(player: Player):
-        opponent = player.group.get_player_by_id(other_player(player))
-        player.group.treatment = player.group.in_round(C.VOTE_ROUND).treatment
-        return dict(
-            opponent=opponent,
-            opponent_role=opponent.player_role,
-            treatment=player.group.treatment,
+class PairWaitPage(core.PairWaitPage):
+    pass
 
-        )
 
 class ResultsWaitPage(WaitPage):
     after_all_players_arrive = set_payoffs
 
+    @staticmethod
+    def is_displayed(player):
+        return not core.pair_sync(player.session) #pairs are resolved as their second partner chooses
+
 
 class Results(Page):
     @staticmethod
     def vars_for_template(player: Player):
-        opponent = player.group.get_player_by_id(other_player(player))
+        opponent = player.group.get_player_by_id(core.other_player(player))
         return dict(
             opponent=opponent,
             same_choice=player.cooperate == opponent.cooperate,
@@ -307,10 +197,9 @@ class Results(Page):
 
 
 
-page_sequence = [OverallIntro, AssignRoleWaitPage, IntroductionRich, IntroductionPoor,
+page_sequence = [OverallIntro, IntroductionRich, IntroductionPoor,
                  Vote, VoteWaitPage, VoteResult,
                  IntroductionRichCooperate, IntroductionPoorCooperate,
-                 MatchInPairsWaitPage, Decision, DecisionAfterVote, ResultsWaitPage, Results,
+                 Decision, DecisionAfterVote, PairWaitPage, ResultsWaitPage, Results,
                  ]
-
-
+page_sequence = instrument.pages(C.NAME_IN_URL, page_sequence) #no-op unless OTREE_PAGE_TIMING is set
@@ -1,5 +1,7 @@
 from otree.api import *
-import random
+
+from common import core, export, fragments, history, instrument, monitor, payoffs
+from common.flow import Page, WaitPage #skip hidden pages in one step
 
 doc = """
 This is a one-shot "Prisoner's Dilemma". Two players are asked separately
@@ -10,7 +12,7 @@ payoffs.
 
 class C(BaseConstants):
     NAME_IN_URL = 'asypay_equalvote'
-    PLAYERS_PER_GROUP = 4
+    PLAYERS_PER_GROUP = None #groups are formed in creating_session, see GROUP_SIZE
     NUM_ROUNDS = 8
     VOTE_ROUND = NUM_ROUNDS/2 + 1
     PAYOFF_DC_L = cu(60)
@@ -31,14 +33,18 @@ class C(BaseConstants):
 
     COST_VOTING = cu(10)
 
+    GROUP_SIZE = 4 #default for the players_per_group session config
+    PAIRING = 'random' #default for the pairing session config, 'random' or 'fixed'
+    NUM_RICH = 2 #rich players per group, default for the rich_per_group session config
+    VOTE_SCHEME = 'equal' #one vote per player
+    TRACK_HISTORY = True
+
+
+PAYOFF_TABLE = payoffs.build_payoff_table(C)
+
 
 class Subsession(BaseSubsession):
     pass
-    # def creating_session(subsession):
-    #     if subsession.round_number == 1:
-    #         subsession.group_randomly() #randomly group subjects in round 1
-    #     else:
-    #         subsession.group_like_round(1) #keep the same group structure as round 1
 
 
 class Group(BaseGroup):
@@ -46,6 +52,9 @@ class Group(BaseGroup):
     total_if_vote = models.IntegerField()
     if_override = models.BooleanField() #whether computer overrides the group decision
     dice = models.BooleanField() #if computer overrides group decision, whether it is exoYES or exoNo
+    pairing = models.StringField() #partner's id_in_group for each player in this round, e.g. '3,4,1,2'
+    coin_flips = models.IntegerField() #vote round only: override and dice bits drawn in creating_session
+    barriers = models.StringField(initial='') #wait page callbacks that have run, see common/barrier.py
 
 
 class Player(BasePlayer):
@@ -60,7 +69,7 @@ class Player(BasePlayer):
 
     if_vote = models.BooleanField(widget=widgets.RadioSelectHorizontal(),
                                   label='Do you want to vote for Game B?')
-    additional_vote_share = models.IntegerField(label='How many additional share(s) you want to buy? (up to 9)', max=9,)
+    additional_vote_share = models.IntegerField(label='How many additional share(s) you want to buy? (up to 9)', min=0, max=9,)
     individual_total_shares = models.IntegerField() #how many shares each have
 
     my_choice = models.StringField()
@@ -76,146 +85,32 @@ class Player(BasePlayer):
     final_payoff = models.CurrencyField()
 
 # FUNCTIONS
-def assign_role(group:Group):
-    rich = random.sample(group.get_players(), 2) #randomly choose two players as a pair in group A
-    poor = []
-    for p in group.get_players():
-        if p not in rich:
-            poor.append(p) #leave the rest of two as a pair in group B
-            p.player_role = 'poor'
-        else:
-            p.player_role = 'rich'
-
-
-def random_match_in_pairs(group:Group):
-    group1 = random.sample(group.get_players(), 2) #randomly choose two players as a pair in group A
-    group2 = []
-    for p in group.get_players():
-        if p not in group1:
-            group2.append(p) #leave the rest of two as a pair in group B
-            p.subgroup = 'B'
-        else:
-            p.subgroup = 'A'
-    if group.round_number > 1:
-        for p in group.get_players():
-            p.player_role = p.in_round(p.round_number - 1).player_role
-
-# def assign_same_role(group: Group):
-#     for p in group.get_players():
-#         p.player_role = p.in_round(p.round_number - 1)
-
-def set_payoffs(group: Group):
-    for p in group.get_players():
-        set_payoff(p)
-
-
-#get opponent id
-def other_player(player: Player):
-    for p in player.get_others_in_group():
-        if p.subgroup == player.subgroup:
-            player.opponent_id = p.id_in_group
-    return player.opponent_id
-
-
-def set_payoff(player: Player):
-    payoff_matrix_h = {
-        (False, True): C.PAYOFF_DC_H,
-        (True, True): C.PAYOFF_CC_H,
-        (False, False): C.PAYOFF_DD_H,
-        (True, False): C.PAYOFF_CD_H,
-    }
-
-    payoff_matrix_l = {
-        (False, True): C.PAYOFF_DC_L,
-        (True, True): C.PAYOFF_CC_L,
-        (False, False): C.PAYOFF_DD_L,
-        (True, False): C.PAYOFF_CD_L,
-    }
-    payoff_matrix_cooperate_h = {
-        (False, True): C.PAYOFF_DC_COOPERATE_H,
-        (True, True): C.PAYOFF_CC_H,
-        (False, False): C.PAYOFF_DD_H,
-        (True, False): C.PAYOFF_CD_H,
-    }
-
-    payoff_matrix_cooperate_l = {
-        (False, True): C.PAYOFF_DC_COOPERATE_L,
-        (True, True): C.PAYOFF_CC_L,
-        (False, False): C.PAYOFF_DD_L,
-        (True, False): C.PAYOFF_CD_L,
-    }
-    other = player.group.get_player_by_id(other_player(player))
-    if player.round_number < C.VOTE_ROUND:
-        if player.player_role == 'rich':
-            player.payoff = payoff_matrix_h[(player.cooperate, other.cooperate)]
-        else:
-            player.payoff = payoff_matrix_l[(player.cooperate, other.cooperate)]
-        if player.round_number == 1:
-            player.cum_payoff_game1 = player.payoff
-        else:
-            player.cum_payoff_game1 = player.in_round(player.round_number-1).cum_payoff_game1 + player.payoff
-    else:
-        if player.group.treatment == ('exoNo' or 'endoNo'):
-            if player.player_role == 'rich':
-                player.payoff = payoff_matrix_h[(player.cooperate, other.cooperate)]
-            else:
-                player.payoff = payoff_matrix_l[(player.cooperate, other.cooperate)]
-        else:
-            if player.player_role == 'rich':
-                player.payoff = payoff_matrix_cooperate_h[(player.cooperate, other.cooperate)]
-            else:
-                player.payoff = payoff_matrix_cooperate_l[(player.cooperate, other.cooperate)]
-        if player.round_number == C.VOTE_ROUND:
-            player.cum_payoff_game2 = player.payoff
-        else:
-            player.cum_payoff_game2 = player.in_round(player.round_number - 1).cum_payoff_game2 + player.payoff
+def creating_session(subsession: Subsession):
+    core.creating_session(subsession, C)
 
 
+def set_payoffs(group: Group):
+    core.set_payoffs(group, C, PAYOFF_TABLE)
 
 
 def assign_treatment(group: Group):
-    players = group.get_players()
-    group_if_vote = [p.if_vote for p in players]
-    group.total_if_vote = sum(group_if_vote)
-    if group.total_if_vote > C.PLAYERS_PER_GROUP/2:
-        group.treatment = 'EndoYes'
-    elif group.total_if_vote < C.PLAYERS_PER_GROUP/2:
-        group.treatment = 'EndoNo'
-    else:
-        group.treatment = 'tie'
-    computer_control = random.choices([1,0], weights=[1,1], k=1)
-    if computer_control[0] == 1:
-        group.if_override = 1
-        dice = random.choices([1,0], weights=[1,1], k=1)
-        if dice[0] == 1:
-            group.dice = 1
-            group.treatment = 'ExoYes'
-        else:
-            group.dice = 0
-            group.treatment = 'ExoNo'
-    else:
-        group.if_override = 0
-
-    if (group.treatment == 'tie') and (group.if_override == 0): #special case where a tie and not overriden by computer, computer randomly choose yes or no
-        dice = random.choices([1, 0], weights=[1, 1], k=1)
-        if dice[0] == 1:
-            group.dice = 1
-            group.treatment = 'EndoYes'
-        else:
-            group.dice = 0
-            group.treatment = 'EndoNo'
+    core.assign_treatment(group, C)
 
 
-# PAGES
-class Introduction(Page):
-    @staticmethod
-    def is_displayed(player):
-        return player.round_number == 1
+def custom_export(players):
+    #one tidy row per player-round, generated lazily; see common/export.py for the streaming CLI
+    yield from export.tidy_rows(players, Player, Group)
+
 
+def vars_for_admin_report(subsession: Subsession):
+    return dict(
+        monitor.admin_report_vars(subsession.session, C.NAME_IN_URL),
+        **instrument.admin_report_vars(C.NAME_IN_URL),
+    )
 
-class AssignRoleWaitPage(WaitPage):
-    after_all_players_arrive = assign_role
 
+# PAGES
+class Introduction(Page):
     @staticmethod
     def is_displayed(player):
         return player.round_number == 1
@@ -226,33 +121,39 @@ class Game1Instructions(Page):
     def is_displayed(player):
         return player.round_number == 1
 
+    @staticmethod
+    def vars_for_template(player: Player):
+        group_size, num_rich, _ = core.layout(player.session, C)
+        return dict(
+            instructions=fragments.render(
+                player, C, 'asypay_equalvote/Game1Instructions_body.html', role=player.player_role,
+                group_size=group_size, num_rich=num_rich, num_poor=group_size - num_rich,
+            ),
+        )
 
-class MatchInPairsWaitPage(WaitPage):
-    after_all_players_arrive = random_match_in_pairs
 
-
-class Decision(Page):
-    form_model = 'player'
-    form_fields = ['cooperate']
+class Decision(core.DecisionPage):
+    constants = C
+    payoff_table = PAYOFF_TABLE
 
     @staticmethod
     def is_displayed(player):
         return player.round_number < C.VOTE_ROUND
 
-    @staticmethod
-    def vars_for_template(player: Player):
-        opponent = player.group.get_player_by_id(other_player(player))
-        return dict(
-            opponent=opponent,
-            opponent_role=opponent.player_role,
-        )
-
 
 class VoteForGame2Instructions(Page):
     @staticmethod
     def is_displayed(player):
         return player.round_number == C.VOTE_ROUND
 
+    @staticmethod
+    def vars_for_template(player: Player):
+        return dict(
+            instructions=fragments.render(
+                player, C, 'asypay_equalvote/VoteForGame2Instructions_body.html', role=player.player_role,
+            ),
+        )
+
 
 class Vote(Page):
     form_model = 'player'
@@ -281,8 +182,9 @@ class VoteResult(Page):
         return dict(
             if_vote='YES' if player.if_vote==1 else 'No',
             total_if_vote=player.group.total_if_vote,
+            group_size=core.layout(player.session, C).group_size,
             if_override='overrides' if player.group.if_override==1 else 'does not override',
-            treatment='Game A' if player.group.treatment==( 'exoNo' or 'endoNo') else 'Game B',
+            treatment='Game A' if core.part2_game(player.group.treatment) == payoffs.GAME_A else 'Game B',
         )
 
 
@@ -291,41 +193,45 @@ class Game2Instructions(Page):
     def is_displayed(player):
         return player.round_number == C.VOTE_ROUND
 
+    @staticmethod
+    def vars_for_template(player: Player):
+        return dict(
+            instructions=fragments.render(
+                player, C, 'asypay_equalvote/Game2Instructions_body.html', role=player.player_role,
+                treatment=player.group.treatment,
+            ),
+        )
+
+    @staticmethod
+    def before_next_page(player: Player, timeout_happened):
+        fragments.release(player) #last instruction page
 
-class DecisionAfterVote(Page):
-    form_model = 'player'
-    form_fields = ['cooperate']
+
+class DecisionAfterVote(core.DecisionPage):
+    constants = C
+    payoff_table = PAYOFF_TABLE
 
     @staticmethod
     def is_displayed(player):
         return player.round_number >= C.VOTE_ROUND
 
-    @staticmethod
-    def vars_for_template(player: Player):
-        opponent = player.group.get_player_by_id(other_player(player))
-        player.group.treatment = player.group.in_round(C.VOTE_ROUND).treatment
 
-        return dict(
-            opponent=opponent,
-            opponent_role=opponent.player_role,
-            treatment=player.group.treatment,
-
-        )
+class PairWaitPage(core.PairWaitPage):
+    pass
 
 
 class ResultsWaitPage(WaitPage):
     after_all_players_arrive = set_payoffs
 
+    @staticmethod
+    def is_displayed(player):
+        return not core.pair_sync(player.session) #pairs are resolved as their second partner chooses
+
 
 class Results(Page):
     @staticmethod
     def vars_for_template(player: Player):
-        opponent = player.group.get_player_by_id(other_player(player))
-        player.my_choice = player.field_display('cooperate')
-        player.opponent_choice = opponent.field_display('cooperate')
-        player.opponent_type = 'type 1' if opponent.player_role == 'rich' else 'type 2'
-        player.opponent_payoff = opponent.payoff
-        player.game2_round = round(player.round_number - C.VOTE_ROUND + 1) if player.round_number >= C.VOTE_ROUND else 0
+        opponent = player.group.get_player_by_id(core.other_player(player))
         return dict(
             opponent=opponent,
             same_choice=player.cooperate == opponent.cooperate,
@@ -335,9 +241,9 @@ class Results(Page):
             before_vote_round=round(C.VOTE_ROUND-1),
             cum_payoff_game1=player.cum_payoff_game1 if player.round_number<C.VOTE_ROUND else 0,
             cum_payoff_game2=player.cum_payoff_game2 if player.round_number>=C.VOTE_ROUND else 0,
-            player_all_rounds=player.in_all_rounds(),
-            player_all_game1_rounds=player.in_rounds(1,round(C.VOTE_ROUND-1)),
-            player_game2_rounds=player.in_rounds(C.VOTE_ROUND, player.round_number) if player.round_number>=C.VOTE_ROUND else 0,
+            player_all_rounds=history.rounds(player.participant, 1, player.round_number),
+            player_all_game1_rounds=history.rounds(player.participant, 1, C.VOTE_ROUND-1),
+            player_game2_rounds=history.rounds(player.participant, C.VOTE_ROUND, player.round_number) if player.round_number>=C.VOTE_ROUND else 0,
         )
 
 class Summary(Page):
@@ -347,20 +253,19 @@ class Summary(Page):
 
     @staticmethod
     def vars_for_template(player: Player):
-        player.final_payoff = player.in_round(C.VOTE_ROUND-1).cum_payoff_game1 + player.in_round(player.round_number).cum_payoff_game2
+        participant = player.participant
         return dict(
             before_vote_round=round(C.VOTE_ROUND-1),
-            cum_payoff_game1=player.in_round(C.VOTE_ROUND-1).cum_payoff_game1,
-            cum_payoff_game2=player.in_round(player.round_number).cum_payoff_game2,
-            player_all_game1_rounds=player.in_rounds(1,round(C.VOTE_ROUND-1)),
-            player_game2_rounds=player.in_rounds(C.VOTE_ROUND, player.round_number),
+            cum_payoff_game1=participant.cum_payoff_game1,
+            cum_payoff_game2=participant.cum_payoff_game2,
+            player_all_game1_rounds=history.rounds(participant, 1, C.VOTE_ROUND-1),
+            player_game2_rounds=history.rounds(participant, C.VOTE_ROUND, player.round_number),
             treatment=player.group.treatment,
             final_payoff=player.final_payoff,
         )
 
 
-page_sequence = [Introduction, AssignRoleWaitPage, Game1Instructions, MatchInPairsWaitPage, Decision,
-                 VoteForGame2Instructions, Vote, VoteWaitPage, VoteResult, Game2Instructions, DecisionAfterVote, ResultsWaitPage, Results, Summary,
+page_sequence = [Introduction, Game1Instructions, Decision,
+                 VoteForGame2Instructions, Vote, VoteWaitPage, VoteResult, Game2Instructions, DecisionAfterVote, PairWaitPage, ResultsWaitPage, Results, Summary,
                  ]
-
-
+page_sequence = instrument.pages(C.NAME_IN_URL, page_sequence) #no-op unless OTREE_PAGE_TIMING is set
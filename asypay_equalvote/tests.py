@@ -0,0 +1,44 @@
+from otree.api import Currency as cu, currency_range, expect, Bot
+from . import *
+from common import bots
+
+
+class PlayerBot(Bot):
+    # cooperate: everyone cooperates and votes for Game B
+    # defect: everyone defects and votes against Game B
+    # mixed: even ids cooperate and vote for Game B, so the vote is a tie
+    cases = ['cooperate', 'defect', 'mixed']
+
+    def play_round(self):
+        # self.player is only read after the ResultsWaitPage: the bot keeps the
+        # first copy of a player it loads, so reading it earlier gives stale payoffs
+        round_number = self.subsession.round_number
+        cooperate = bots.wants_to_cooperate(self.case, self.participant)
+
+        if round_number == 1:
+            yield Introduction
+            yield Game1Instructions
+        if round_number < C.VOTE_ROUND:
+            yield from bots.decide(self, Decision, PairWaitPage, cooperate)
+        if round_number == C.VOTE_ROUND:
+            yield VoteForGame2Instructions
+            yield Vote, dict(if_vote=cooperate)
+            yield VoteResult
+            yield Game2Instructions
+        if round_number >= C.VOTE_ROUND:
+            yield from bots.decide(self, DecisionAfterVote, PairWaitPage, cooperate)
+
+        player = self.player
+        rich = player.player_role == 'rich'
+        if self.case == 'cooperate':
+            expect(player.payoff, C.PAYOFF_CC_H if rich else C.PAYOFF_CC_L)
+        if self.case == 'defect':
+            expect(player.payoff, C.PAYOFF_DD_H if rich else C.PAYOFF_DD_L)
+        expect(player.my_choice, player.field_display('cooperate'))
+        yield Results
+
+        if round_number == C.NUM_ROUNDS:
+            if self.case != 'mixed':
+                expect(player.final_payoff, C.NUM_ROUNDS * player.payoff)
+            yield Summary
+
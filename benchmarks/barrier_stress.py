@@ -0,0 +1,328 @@
+"""
+Multi-process check that after_all_players_arrive runs once per group, and
+that with sync='pair' every pair's payoffs are set exactly once.
+
+Creates a session of an app in a fresh SQLite file, in a temporary folder
+that links to the project's files (or in the database of DATABASE_URL,
+e.g. a local PostgreSQL), and fills in
+every player's decisions and votes. Then --processes worker processes run
+the wait page callbacks of every group at the same time, round by round:
+VoteWaitPage's assign_treatment in the vote round and ResultsWaitPage's
+set_payoffs in every round. Every worker behaves like the request of a
+group's last player to arrive, each in its own process and transaction, so
+every callback is hammered --processes times per group.
+
+With a session config that has sync='pair' or live_decisions (e.g.
+asypay_equalvote_pairs) there is no ResultsWaitPage. Instead the choices
+are left empty, and every round the workers submit them like the decision
+page does: both partners of a pair are submitted at the same moment by two
+different workers, so both may read the other as undecided, or both may
+set the payoffs. SQLite lets one transaction write at a time, which
+already keeps the partners apart; to see that race with --unguarded, run
+it on PostgreSQL.
+
+Afterwards the session must look as if each callback had run once per
+group and each pair had been resolved once (see common/barrier.py): one
+history row per participant and round, participant payoffs that add up
+their players' payoffs, cooperation counts of the session
+monitor adding up to the number of participants in each round, and one
+part II treatment counted per group. Exits with status 1 otherwise.
+--unguarded turns the guard off, to see the check fail.
+
+--fail makes the first resolution of every group in each worker fail half
+way, after the payoffs of one player have been set, like a request that
+crashes. The failed request must leave nothing behind, its claim included,
+so that the retry (the request of the next player to arrive) resolves the
+whole group:
+
+    python benchmarks/barrier_stress.py
+    python benchmarks/barrier_stress.py --processes 16 --groups 50
+    python benchmarks/barrier_stress.py --session-config asypay_equalvote_pairs
+    python benchmarks/barrier_stress.py --unguarded
+    python benchmarks/barrier_stress.py --fail
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RETRIES = 50
+
+
+def link_project(folder):
+    """Make folder a copy of the project, except for its database."""
+    for name in os.listdir(PROJECT_ROOT):
+        if name != 'db.sqlite3' and not name.startswith('.'):
+            os.symlink(os.path.join(PROJECT_ROOT, name), os.path.join(folder, name))
+
+
+def setup_otree(folder):
+    # without DATABASE_URL, otree uses db.sqlite3 in the working directory
+    os.chdir(folder)
+    sys.path.insert(0, folder)
+    from otree.main import setup
+
+    setup()
+
+
+def create_session(module, session_config_name, num_participants, seed):
+    """Code of a new session in which every player has voted, and decided
+    unless pairs are resolved as their partners choose."""
+    import otree.session
+    from common import core
+    from otree.database import session_scope
+    from otree.models import Session
+
+    rng = random.Random(seed)
+    with session_scope():
+        session = otree.session.create_session(
+            session_config_name=session_config_name, num_participants=num_participants
+        )
+        code, pair_sync = session.code, core.pair_sync(session)
+    with session_scope():
+        for player in module.Player.objects_filter(session=Session.objects_get(code=code)):
+            if not pair_sync:
+                player.cooperate = rng.random() < 0.5
+            player.if_vote = rng.random() < 0.5
+            player.additional_vote_share = rng.randrange(10)
+    return code, pair_sync
+
+
+def wait_page_callbacks(module, round_number, pair_sync):
+    C = module.C
+    pages = [module.VoteWaitPage] if round_number == C.VOTE_ROUND else []
+    if not pair_sync:
+        pages.append(module.ResultsWaitPage)
+    return [page.after_all_players_arrive for page in pages]
+
+
+class InjectedFailure(Exception):
+    pass
+
+
+def fail_half_way():
+    """Make core.set_payoff raise at the second player of the first
+    resolution of every group, once per group and round."""
+    from common import core
+
+    set_payoff = core.set_payoff
+    calls = {}
+
+    def failing_set_payoff(player, payoff):
+        key = (player.round_number, player.group.id_in_subsession)
+        calls[key] = calls.get(key, 0) + 1
+        if calls[key] == 2:
+            raise InjectedFailure(f'group {key[1]} of round {key[0]}')
+        set_payoff(player, payoff)
+
+    core.set_payoff = failing_set_payoff
+
+
+def in_transaction(module, session_code, round_number, id_in_subsession, func):
+    """Run func(group) in its own transaction, like a request of one of the group's players."""
+    from otree.database import db, session_scope
+    from otree.models import Session
+    from sqlalchemy.exc import OperationalError
+
+    for attempt in range(RETRIES):
+        try:
+            with session_scope():
+                db.expire_all()
+                group = module.Group.objects_get(
+                    session=Session.objects_get(code=session_code),
+                    round_number=round_number,
+                    id_in_subsession=id_in_subsession,
+                )
+                func(group)
+            return
+        except OperationalError:
+            #SQLite: 'database is locked' once its busy timeout is over
+            time.sleep(random.random() * 0.05 * (attempt + 1))
+        except InjectedFailure:
+            pass #rolled back by session_scope; try again like the next request
+    raise RuntimeError(f'group {id_in_subsession} of round {round_number} failed {RETRIES} times')
+
+
+def submit_decision(module, round_number, id_in_group):
+    """What the decision page does with the choice of the player id_in_group
+    of a group: its live method with live_decisions, else its POST."""
+    from common import core
+
+    page = module.Decision if round_number < module.C.VOTE_ROUND else module.DecisionAfterVote
+
+    def submit(group):
+        player = group.get_player_by_id(id_in_group)
+        choice = random.Random(f'{round_number}-{group.id_in_subsession}-{id_in_group}').random() < 0.5
+        if core.live_decisions(group.session):
+            page.live_method(player, dict(cooperate=choice))
+        else:
+            player.cooperate = choice
+            page.before_next_page(player, timeout_happened=False)
+
+    return submit
+
+
+def pair_submissions(module, session_code, round_number, seed, num_processes):
+    """[(id_in_subsession, id_in_group)] of each worker: the partners of a pair
+    go to different workers, and all workers go through the pairs in the same order."""
+    from common import matching
+    from otree.database import session_scope
+    from otree.models import Session
+
+    with session_scope():
+        groups = module.Group.objects_filter(
+            session=Session.objects_get(code=session_code), round_number=round_number
+        )
+        pairs = [
+            (group.id_in_subsession, k + 1, partner + 1)
+            for group in groups
+            for k, partner in enumerate(matching.partner_positions(group.pairing))
+            if k < partner
+        ]
+    random.Random(f'{seed}-{round_number}').shuffle(pairs)
+    submissions = [[] for _ in range(num_processes)]
+    for j, (id_in_subsession, first, second) in enumerate(pairs):
+        submissions[2 * j % num_processes].append((id_in_subsession, first))
+        submissions[(2 * j + 1) % num_processes].append((id_in_subsession, second))
+    return submissions
+
+
+def worker(folder, app_name, session_code, pair_sync, num_groups, start, unguarded, fail, seed, k, num_processes):
+    try:
+        run_worker(folder, app_name, session_code, pair_sync, num_groups, start, unguarded, fail, seed, k, num_processes)
+    except BaseException:
+        start.abort() #the other workers would wait for this one forever
+        raise
+
+
+def run_worker(folder, app_name, session_code, pair_sync, num_groups, start, unguarded, fail, seed, k, num_processes):
+    setup_otree(folder)
+    import importlib
+    from common import barrier
+
+    if unguarded:
+        barrier.claim = lambda group, name: True
+        barrier.lock = lambda group: None
+    if fail:
+        fail_half_way()
+    module = importlib.import_module(app_name)
+    rng = random.Random(seed + k)
+    for round_number in range(1, module.C.NUM_ROUNDS + 1):
+        for callback in wait_page_callbacks(module, round_number, pair_sync):
+            groups = list(range(1, num_groups + 1))
+            rng.shuffle(groups)
+            start.wait() #all workers run the same callback of the same round at once
+            for id_in_subsession in groups:
+                in_transaction(
+                    module, session_code, round_number, id_in_subsession,
+                    lambda group: callback(group=group),
+                )
+        if pair_sync:
+            submissions = pair_submissions(module, session_code, round_number, seed, num_processes)[k]
+            start.wait()
+            for id_in_subsession, id_in_group in submissions:
+                in_transaction(
+                    module, session_code, round_number, id_in_subsession,
+                    submit_decision(module, round_number, id_in_group),
+                )
+
+
+def check(app_name, session_code, num_groups):
+    """Violations of exactly-once, as messages."""
+    import importlib
+    from common import monitor
+    from otree.database import session_scope
+    from otree.models import Session
+
+    module = importlib.import_module(app_name)
+    C = module.C
+    problems = []
+    with session_scope():
+        session = Session.objects_get(code=session_code)
+        participants = session.get_participants()
+        for participant in participants:
+            rounds = [row[0] for row in participant.vars.get('history', [])]
+            if rounds != list(range(1, C.NUM_ROUNDS + 1)):
+                problems.append(f'participant {participant.code} has history rounds {rounds}')
+            total = sum(p.payoff for p in module.Player.objects_filter(participant=participant))
+            if participant.payoff != total:
+                problems.append(f'participant {participant.code} has payoff {participant.payoff}, its rounds {total}')
+        decisions = monitor.decisions(session, C.NAME_IN_URL)
+        for round_number in range(1, C.NUM_ROUNDS + 1):
+            players = sum(counts[0] for (r, role, treatment), counts in decisions.items() if r == round_number)
+            if players != len(participants):
+                problems.append(f'round {round_number}: {players} decisions counted for {len(participants)} players')
+        groups = sum(totals[0] for totals in monitor.votes(session, C.NAME_IN_URL).values())
+        if groups != num_groups:
+            problems.append(f'{groups} treatments counted for {num_groups} groups')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--session-config', default='asypay_equalvote')
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--unguarded', action='store_true', help='run without the guard of common/barrier.py')
+    parser.add_argument('--fail', action='store_true', help='let the first resolution of every group fail half way')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='barrier_stress_')
+    try:
+        link_project(folder)
+        setup_otree(folder)
+        import importlib
+        from settings import SESSION_CONFIGS
+
+        config = next(config for config in SESSION_CONFIGS if config['name'] == args.session_config)
+        app_name = config['app_sequence'][0]
+        num_participants = args.groups * config['players_per_group']
+        session_code, pair_sync = create_session(
+            importlib.import_module(app_name), args.session_config, num_participants, args.seed
+        )
+
+        context = multiprocessing.get_context('spawn')
+        start = context.Barrier(args.processes)
+        processes = [
+            context.Process(
+                target=worker,
+                args=(
+                    folder, app_name, session_code, pair_sync, args.groups, start, args.unguarded, args.fail,
+                    args.seed, k, args.processes,
+                ),
+            )
+            for k in range(args.processes)
+        ]
+        began = time.perf_counter()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        if any(process.exitcode for process in processes):
+            sys.exit('a worker failed')
+        seconds = time.perf_counter() - began
+
+        problems = check(app_name, session_code, args.groups)
+        print(
+            f'{args.session_config}: {args.groups} groups, {args.processes} processes, '
+            f'{seconds:.1f}s, {"unguarded" if args.unguarded else "guarded"}'
+            + (', failing half way once per group' if args.fail else '')
+        )
+        for problem in problems[:20]:
+            print('  ' + problem)
+        done = 'every callback ran once per group' + (' and every pair was resolved once' if pair_sync else '')
+        print(f'{len(problems)} violations of exactly-once' if problems else done)
+        sys.exit(1 if problems else 0)
+    finally:
+        os.chdir(PROJECT_ROOT)
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
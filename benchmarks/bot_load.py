@@ -0,0 +1,214 @@
+"""
+Load test for the wait pages of the treatment apps.
+
+Plays whole sessions with each app's bots (tests.py) at the given sizes and
+reports per-page latency percentiles and wait-page release times, i.e. how
+long a participant sits on VoteWaitPage / ResultsWaitPage (or PairWaitPage
+with sync='pair') before being let through, and the mean of that waiting per
+participant and round.
+
+Bots answer at once unless --think-ms is given; then every participant
+spends an exponentially distributed time on each page before submitting it,
+so the slowest member of a group holds up the others as in a lab session.
+That is where sync='pair' shows, as only the partner is waited for:
+
+    python benchmarks/bot_load.py asypay_equalvote 40 --think-ms 200
+    python benchmarks/bot_load.py asypay_equalvote_pairs 40 --think-ms 200
+
+The bots talk to the same ASGI app that `otree devserver` and `otree
+prodserver` serve, in-process, so every page is a real request with form
+validation, templates and database round trips. The database is the
+in-memory SQLite one used by `otree test`, unless DATABASE_URL is set (e.g.
+to a local PostgreSQL).
+
+Run from the project root:
+
+    python benchmarks/bot_load.py asypay_equalvote 200 500
+    python benchmarks/bot_load.py equalpay_asyvote 400 --case 2
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# regular pages that hold a participant until the partner has chosen; the
+# browser submits them through their live channel once error_message passes
+PAIR_WAIT_PAGES = ('PairWaitPage',)
+# pages whose error_message waits for the partner, the decision pages only with live_decisions
+PARTNER_PAGES = PAIR_WAIT_PAGES + ('Decision', 'DecisionAfterVote')
+
+
+def setup_otree():
+    os.chdir(PROJECT_ROOT)
+    sys.path.insert(0, PROJECT_ROOT)
+    if not os.environ.get('DATABASE_URL'):
+        os.environ['OTREE_IN_MEMORY'] = '1'
+    from otree.main import setup
+
+    setup()
+    # every submit is logged at INFO level
+    logging.getLogger('otree.bots').setLevel(logging.WARNING)
+
+
+def page_name(path):
+    # /p/<participant code>/<app>/<Page>/<index>
+    parts = path.strip('/').split('/')
+    return parts[3] if len(parts) >= 4 else path
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[k]
+
+
+class LoadStats:
+    def __init__(self):
+        self.page_latency = defaultdict(list)
+        self.wait_release = defaultdict(list)
+        self.wall_time = 0
+        self.participant_rounds = 0
+
+    def report(self, title):
+        print(f'\n{title}: {self.wall_time:.1f}s wall time')
+        print(f"{'page':<28}{'n':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for name, values in self.page_latency.items():
+            self._row(name, values)
+        print(f"\n{'wait page release':<28}{'n':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for name, values in self.wait_release.items():
+            self._row(name, values)
+        if self.participant_rounds:
+            total_wait = sum(sum(values) for values in self.wait_release.values())
+            print(f'\nmean wait per participant and round: {total_wait / self.participant_rounds * 1000:.1f} ms')
+
+    @staticmethod
+    def _row(name, values):
+        ms = [v * 1000 for v in values]
+        print(
+            f'{name:<28}{len(ms):>7}{percentile(ms, 50):>10.1f}{percentile(ms, 90):>10.1f}'
+            f'{percentile(ms, 99):>10.1f}{max(ms):>10.1f}'
+        )
+
+
+def partner_ready(bot, submission):
+    """Whether a page of PARTNER_PAGES would accept the submit now."""
+    from otree.database import db
+    from otree.lookup import get_page_lookup
+
+    db.expire_all() #the partner's choice was saved by a request, after the bots may have loaded the partner
+
+    lookup = get_page_lookup(bot.session_code, int(bot.path.rsplit('/', 1)[-1]))
+    player = next(
+        player_bot.player for player_bot in bot.player_bots
+        if player_bot.PlayerClass.__module__ == lookup.app_name and player_bot.round_number == lookup.round_number
+    )
+    return submission.page_class.error_message(player, {}) is None
+
+
+def play(bots, stats: LoadStats, think_time=0.0, rng=random):
+    """Round-robin over the bots like otree's SessionBotRunner, timing every
+    submit and the time each bot spends on a wait page.
+
+    think_time is the mean time in seconds a bot spends on a page before
+    submitting it."""
+    from otree.bots.bot import is_wait_page
+
+    waiting = {}  # bot -> (wait page name, arrival time)
+    ready_at = {}  # bot -> when it is done thinking about its page
+    held = {}  # bot -> submission for a page of PARTNER_PAGES, until the partner has chosen
+
+    def arrived(bot):
+        now = time.perf_counter()
+        name = page_name(bot.path)
+        if is_wait_page(bot.response) or name in PAIR_WAIT_PAGES:
+            waiting.setdefault(bot, (name, now)) #still waiting after a submit that must fail
+            ready_at[bot] = now
+        else:
+            ready_at[bot] = now + (rng.expovariate(1 / think_time) if think_time else 0)
+
+    for bot in bots:
+        bot.open_start_url()
+        arrived(bot)
+
+    pending = list(bots)
+    loops_without_progress = 0
+    while pending:
+        if loops_without_progress > 10:
+            raise AssertionError('Bots got stuck')
+        progress_made = False
+        thinking = False
+        for bot in list(pending):
+            if bot.on_wait_page():
+                continue
+            if time.perf_counter() < ready_at[bot]:
+                thinking = True
+                continue
+            if bot in held:
+                submission = held.pop(bot)
+            else:
+                try:
+                    submission = bot.get_next_submit()
+                except StopIteration:
+                    pending.remove(bot)
+                    progress_made = True
+                    continue
+            if submission.page_class.__name__ in PARTNER_PAGES:
+                ready = partner_ready(bot, submission)
+                if submission.post_data.get('must_fail') and ready:
+                    # the bots' early submits (common/bots.py) are only early if the partner is still choosing
+                    progress_made = True
+                    continue
+                if not submission.post_data.get('must_fail') and not ready:
+                    held[bot] = submission
+                    continue
+            if bot in waiting and not submission.post_data.get('must_fail'):
+                name, since = waiting.pop(bot)
+                stats.wait_release[name].append(time.perf_counter() - since)
+            start = time.perf_counter()
+            bot.submit(submission)
+            stats.page_latency[submission.page_class.__name__].append(time.perf_counter() - start)
+            arrived(bot)
+            progress_made = True
+        if thinking and not progress_made:
+            time.sleep(0.001)
+        else:
+            loops_without_progress = 0 if progress_made else loops_without_progress + 1
+
+
+def run(session_config_name, num_participants, case_number=0, think_time=0.0, seed=None) -> LoadStats:
+    import otree.session
+    from otree.bots.runner import make_bots
+
+    session = otree.session.create_session(
+        session_config_name=session_config_name, num_participants=num_participants
+    )
+    bots = make_bots(session_pk=session.id, case_number=case_number, use_browser_bots=False)
+    stats = LoadStats()
+    stats.participant_rounds = num_participants * len(bots[0].player_bots) #one player bot per round
+    start = time.perf_counter()
+    play(bots, stats, think_time, random.Random(seed))
+    stats.wall_time = time.perf_counter() - start
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('session_config_name')
+    parser.add_argument('sizes', type=int, nargs='+', help='number of participants per session')
+    parser.add_argument('--case', type=int, default=0, help="index into the bots' cases")
+    parser.add_argument('--think-ms', type=float, default=0, help='mean time a participant spends on a page')
+    parser.add_argument('--seed', type=int, help='seed of the think times')
+    args = parser.parse_args()
+
+    setup_otree()
+    for size in args.sizes:
+        stats = run(args.session_config_name, size, args.case, args.think_ms / 1000, args.seed)
+        stats.report(f'{args.session_config_name}, {size} participants, case {args.case}')
+
+
+if __name__ == '__main__':
+    main()
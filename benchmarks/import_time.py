@@ -0,0 +1,105 @@
+"""
+Import cost of each app, i.e. what an app adds to the cold start of an
+`otree prodserver` worker or a `otree devserver` reload (see Procfile).
+
+Every app is imported in a fresh interpreter with `python -X importtime`,
+after otree.api, which every worker loads anyway. The cost reported for an
+app is the cumulative import time of its package, including the modules it
+pulls in that oTree does not, such as common/ and any heavy third-party
+packages. The fastest of --repeat runs is kept to filter out noise.
+
+Exits with status 1 if an app is over --budget-ms, so it can run in CI:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py asypay_equalvote --budget-ms 30 --repeat 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# packages that must not be imported when an app is loaded
+HEAVY_PACKAGES = ('numpy', 'pandas', 'pyarrow', 'scipy')
+
+
+def default_apps():
+    sys.path.insert(0, PROJECT_ROOT)
+    from settings import SESSION_CONFIGS
+
+    apps = []
+    for config in SESSION_CONFIGS:
+        for app_name in config['app_sequence']:
+            if app_name not in apps:
+                apps.append(app_name)
+    return apps
+
+
+def import_times(app_name):
+    """{module: (self us, cumulative us, depth)} of one import of app_name."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import otree.api; import {app_name}'],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        raise RuntimeError(f'importing {app_name} failed:\n{result.stderr}')
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        times[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return times
+
+
+def app_cost(app_name, repeat):
+    """(ms, heavy packages imported, slowest modules under the app) of the fastest run."""
+    runs = []
+    for _ in range(repeat):
+        times = import_times(app_name)
+        # modules are listed after the ones they import, so the app's own
+        # imports are the entries right before it that are nested deeper
+        names = list(times)
+        end = names.index(app_name)
+        start = end
+        while start > 0 and times[names[start - 1]][2] > times[app_name][2]:
+            start -= 1
+        loaded = names[start:end]
+        runs.append((times[app_name][1] / 1000, loaded, times))
+    ms, loaded, times = min(runs, key=lambda run: run[0])
+    heavy = [name for name in loaded if name.split('.')[0] in HEAVY_PACKAGES and '.' not in name]
+    slowest = sorted(
+        (name for name in loaded if times[name][2] == times[app_name][2] + 1),
+        key=lambda name: times[name][1],
+        reverse=True,
+    )[:3]
+    return ms, heavy, [(name, times[name][1] / 1000) for name in slowest]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('apps', nargs='*', help='apps of settings.SESSION_CONFIGS if omitted')
+    parser.add_argument('--budget-ms', type=float, default=50, help='maximum import time of an app')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    over_budget = False
+    print(f"{'app':<22}{'import ms':>11}  slowest imports")
+    for app_name in args.apps or default_apps():
+        ms, heavy, slowest = app_cost(app_name, args.repeat)
+        details = ', '.join(f'{name} {module_ms:.1f}' for name, module_ms in slowest)
+        flag = ''
+        if ms > args.budget_ms:
+            flag = f'  OVER BUDGET ({args.budget_ms:.0f} ms)'
+            over_budget = True
+        print(f'{app_name:<22}{ms:>11.1f}  {details}{flag}')
+        if heavy:
+            print(f"{'':<22}{'':>11}  imports {', '.join(heavy)} at startup")
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
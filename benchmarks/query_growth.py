@@ -0,0 +1,263 @@
+"""
+Regression check for database queries that grow with the round number.
+
+Plays whole sessions with each app's bots (tests.py), like bot_load.py,
+and counts the SQL statements and wall time of every request a participant
+makes, i.e. the GET that shows a page (including the polls of wait pages)
+and the POST that submits it. The counts are grouped by page, request
+method and round, for rounds 1 to C.NUM_ROUNDS.
+
+Rounds are only compared with like rounds, within each part of the app
+(rounds before C.VOTE_ROUND and from it on): a page fails the check when
+its mean number of queries per request in the last round of a part exceeds
+that of the second round of the part by more than --tolerance. The first
+round of a part is left out, as it sets things up, e.g. starts the part's
+running totals. So is a POST whose next page lies in another part or
+after the app, e.g. Results in the last round of a part, which goes on to
+the next part's first pages. A page that loads the history of all rounds
+played so far has more queries in the last round and fails, and so does a
+page that adds one query every other round. In a 500-person session a
+growing page costs O(rounds^2) queries per participant, so the check exits
+with status 1 and lists the pages that grow.
+
+The sessions are played again with one group of each of --group-sizes
+players, counting the queries of every resolution of a group or pair
+(core.resolve, up to and including the flush that writes its results).
+Those must not grow with the group size either: the mean at the largest
+size may exceed the one at the smallest size by at most --tolerance.
+
+The database is the in-memory SQLite one used by `otree test`, unless
+DATABASE_URL is set, e.g. to a local PostgreSQL. Run from the project root:
+
+    python benchmarks/query_growth.py
+    python benchmarks/query_growth.py asypay_equalvote_pairs --participants 16
+    DATABASE_URL=postgres://localhost/otree python benchmarks/query_growth.py
+"""
+import argparse
+import sys
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from bot_load import LoadStats, play, setup_otree
+
+#oTree's own bookkeeping: it stores the time of a participant's last request
+#and page when the second has changed (in one UPDATE if both have), and writes
+#the page times of all participants in batches, so these depend on the speed
+#of the machine
+BOOKKEEPING = (
+    'UPDATE otree_participant SET _last_request_timestamp=? WHERE',
+    'UPDATE otree_participant SET _last_page_timestamp=? WHERE',
+    'UPDATE otree_participant SET _last_page_timestamp=?, _last_request_timestamp=? WHERE',
+    'INSERT INTO otree_pagetimebatch ',
+)
+
+
+class RoundCounts:
+    """Queries and ms per request, by (page, method) and round."""
+
+    def __init__(self):
+        self.queries = defaultdict(lambda: defaultdict(list))
+        self.ms = defaultdict(lambda: defaultdict(list))
+        self.within_part = defaultdict(lambda: defaultdict(list)) #queries of requests that stay in their part
+        self.app_pages = defaultdict(list) #app -> (page, method) in the order they were requested
+        self.resolutions = [] #queries of each core.resolve
+
+    def add(self, app_name, page, method, round_number, queries, ms, next_round=None):
+        """next_round: round of the page a POST goes on to in the same app, if any."""
+        key = (page, method)
+        if key not in self.app_pages[app_name]:
+            self.app_pages[app_name].append(key)
+        self.queries[key][round_number].append(queries)
+        self.ms[key][round_number].append(ms)
+        parts = app_parts(app_name)
+        if method != 'POST' or part_of(parts, next_round) == part_of(parts, round_number):
+            self.within_part[key][round_number].append(queries)
+
+    @staticmethod
+    def means(by_round):
+        return {r: sum(values) / len(values) for r, values in sorted(by_round.items())}
+
+    def growing(self, tolerance):
+        """{(page, method): (second round, last round, queries added)} of the pages that grow."""
+        result = {}
+        for app_name, keys in self.app_pages.items():
+            for key in keys:
+                means = self.means(self.within_part[key])
+                for part in app_parts(app_name):
+                    shown = [r for r in part[1:] if r in means]
+                    if len(shown) < 2:
+                        continue
+                    added = means[shown[-1]] - means[shown[0]]
+                    if added > tolerance and added > result.get(key, (0, 0, 0))[2]:
+                        result[key] = (shown[0], shown[-1], added)
+        return result
+
+
+def app_parts(app_name):
+    """The rounds of each part of the app, as lists."""
+    import importlib
+
+    C = importlib.import_module(app_name).C
+    vote_round = int(getattr(C, 'VOTE_ROUND', 1))
+    return [r for r in (list(range(1, vote_round)), list(range(vote_round, C.NUM_ROUNDS + 1))) if r]
+
+
+def part_of(parts, round_number):
+    return next((k for k, part in enumerate(parts) if round_number in part), None)
+
+
+class CountingApp:
+    """ASGI wrapper that counts the queries of each request to a page URL."""
+
+    def __init__(self, app, session_code, counts: RoundCounts):
+        self.app = app
+        self.session_code = session_code
+        self.counts = counts
+        self.queries = 0
+
+    def count_query(self, conn, cursor, statement, *args):
+        if not statement.startswith(BOOKKEEPING):
+            self.queries += 1
+
+    async def __call__(self, scope, receive, send):
+        parts = page_path(scope['path']) if scope['type'] == 'http' else None
+        if not parts:
+            return await self.app(scope, receive, send)
+        location = []
+
+        async def send_and_watch(message):
+            if message['type'] == 'http.response.start':
+                location.extend(value.decode() for name, value in message['headers'] if name == b'location')
+            await send(message)
+
+        queries = self.queries
+        start = time.perf_counter()
+        await self.app(scope, receive, send_and_watch)
+        ms = (time.perf_counter() - start) * 1000
+        from otree.lookup import get_page_lookup
+
+        lookup = get_page_lookup(self.session_code, int(parts[4]))
+        next_round = None
+        next_parts = page_path(urlsplit(location[0]).path) if location else None
+        if next_parts and next_parts[2] == parts[2]:
+            next_round = get_page_lookup(self.session_code, int(next_parts[4])).round_number
+        self.counts.add(
+            parts[2], parts[3], scope['method'], lookup.round_number, self.queries - queries, ms, next_round
+        )
+
+
+def page_path(path):
+    """/p/<participant code>/<app>/<Page>/<index> split at the slashes, or None."""
+    parts = path.strip('/').split('/')
+    return parts if len(parts) == 5 and parts[0] == 'p' else None
+
+
+def run(session_config_name, num_participants, case_number=0, players_per_group=None) -> RoundCounts:
+    import otree.session
+    from common import core
+    from otree.asgi import app
+    from otree.bots.runner import make_bots
+    from otree.database import engine
+    from sqlalchemy import event
+    from sqlalchemy.orm import object_session
+    from starlette.testclient import TestClient
+
+    session = otree.session.create_session(
+        session_config_name=session_config_name,
+        num_participants=num_participants,
+        modified_session_config_fields=dict(players_per_group=players_per_group) if players_per_group else None,
+    )
+    bots = make_bots(session_pk=session.id, case_number=case_number, use_browser_bots=False)
+    counts = RoundCounts()
+    counting_app = CountingApp(app, session.code, counts)
+    for bot in bots:
+        bot._client = TestClient(counting_app)
+    resolve = core.resolve
+
+    def counting_resolve(group, *args):
+        queries = counting_app.queries
+        resolve(group, *args)
+        object_session(group).flush()
+        counts.resolutions.append(counting_app.queries - queries)
+
+    core.resolve = counting_resolve
+    event.listen(engine, 'before_cursor_execute', counting_app.count_query)
+    try:
+        play(bots, LoadStats())
+    finally:
+        event.remove(engine, 'before_cursor_execute', counting_app.count_query)
+        core.resolve = resolve
+    return counts
+
+
+def resolution_growth(session_config_name, group_sizes, case_number, tolerance):
+    """Mean queries of a resolution by group size, and whether they grow."""
+    means = {}
+    for size in group_sizes:
+        resolutions = run(session_config_name, size, case_number, players_per_group=size).resolutions
+        means[size] = sum(resolutions) / len(resolutions)
+    return means, means[max(group_sizes)] - means[min(group_sizes)] > tolerance
+
+
+def report(title, counts: RoundCounts, growing):
+    print(f'\n{title}')
+    for app_name, keys in counts.app_pages.items():
+        rounds = sorted({r for key in keys for r in counts.queries[key]})
+        header = ''.join(f'{r:>8}' for r in rounds)
+        print(f"{app_name + ' queries per request, by round':<44}{header}")
+        for key in keys:
+            _row(key, counts.means(counts.queries[key]), rounds, growing.get(key))
+        print(f"{app_name + ' ms per request, by round':<44}{header}")
+        for key in keys:
+            _row(key, counts.means(counts.ms[key]), rounds)
+
+
+def _row(key, means, rounds, growth=None):
+    page, method = key
+    cells = ''.join(f'{means[r]:>8.1f}' if r in means else f"{'':>8}" for r in rounds)
+    flag = ''
+    if growth is not None:
+        first, last, added = growth
+        flag = f'  GROWS by {added:.1f} from round {first} to {last}'
+    print(f"  {page + ' ' + method:<42}{cells}{flag}")
+
+
+def default_configs():
+    from settings import SESSION_CONFIGS
+
+    return [config['name'] for config in SESSION_CONFIGS]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('session_config_names', nargs='*', help='all of settings.SESSION_CONFIGS if omitted')
+    parser.add_argument('--participants', type=int, default=8)
+    parser.add_argument('--case', type=int, default=0, help="index into the bots' cases")
+    parser.add_argument(
+        '--tolerance', type=float, default=0.5,
+        help='queries a request (or resolution) may add from the second to the last round of a part, '
+        'or from the smallest to the largest group',
+    )
+    parser.add_argument('--group-sizes', type=int, nargs='+', default=[4, 8, 16])
+    args = parser.parse_args()
+
+    setup_otree()
+    failed = []
+    for name in args.session_config_names or default_configs():
+        counts = run(name, args.participants, args.case)
+        growing = counts.growing(args.tolerance)
+        report(f'{name}, {args.participants} participants, case {args.case}', counts, growing)
+        failed += [f'{name}: {page} {method}' for page, method in growing]
+        means, grows = resolution_growth(name, args.group_sizes, args.case, args.tolerance)
+        cells = ', '.join(f'{mean:.1f} with {size} players' for size, mean in means.items())
+        print(f"queries per resolution: {cells}{'  GROWS' if grows else ''}")
+        if grows:
+            failed.append(f'{name}: resolution, by group size')
+    if failed:
+        print('\nqueries grow with the round number or group size on:\n  ' + '\n  '.join(failed))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
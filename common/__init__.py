@@ -0,0 +1,5 @@
+"""
+Code shared by the prisoner's dilemma apps (asypay_equalvote, equalpay_asyvote,
+asypay_asyvote). This package is not an oTree app and is not listed in any
+app_sequence.
+"""
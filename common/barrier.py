@@ -0,0 +1,65 @@
+"""
+Exactly-once guard for the after_all_players_arrive of group wait pages.
+
+oTree runs after_all_players_arrive in the request of the last player to
+arrive at a wait page. With several web processes serving one session, the
+last two players of a group can arrive at the same moment in different
+processes, and both requests may see a complete group and run it, e.g.
+set_payoffs would add every payoff to the running totals twice.
+
+claim() records that a callback has run on the group row itself, with one
+conditional UPDATE in the request's transaction:
+
+    UPDATE <app>_group SET barriers = barriers || 'set_payoffs;'
+    WHERE id = :id AND barriers NOT LIKE '%set_payoffs;%'
+
+The UPDATE holds the row's write lock (PostgreSQL) or the database's write
+lock (SQLite) until the request commits. A second process claiming the same
+callback waits for the first one and then matches no row, so it skips the
+callback. If the first request fails, its claim is rolled back with the
+rest of its changes and the next arrival runs the callback. That only holds
+as long as the callback does not commit on its way: oTree's player.payoff
+setter calls db.commit(), so the callbacks set payoffs with core.set_payoff
+instead (benchmarks/barrier_stress.py --fail checks this). This works the
+same on both databases, unlike PostgreSQL's advisory locks, and costs one
+statement per group and wait page.
+
+With sync='pair' there is no wait page: both partners of a pair submit
+their choice and the second one sets the pair's payoffs. lock() takes the
+same row lock without recording anything, so that the two requests read
+each other's choice one after the other instead of at the same time (see
+core.resolve_pair).
+"""
+
+
+def claim(group, name):
+    """Whether this request is the one to run callback name for group.
+
+    The Group model needs a barriers field:
+        barriers = models.StringField(initial='')
+    """
+    from sqlalchemy import func
+    from sqlalchemy.orm import object_session
+
+    table = type(group).__table__
+    tag = name + ';'
+    done = func.coalesce(table.c.barriers, '')
+    result = object_session(group).execute(
+        table.update()
+        .where(table.c.id == group.id)
+        .where(~done.contains(tag))
+        .values(barriers=done + tag)
+    )
+    return result.rowcount == 1
+
+
+def lock(group):
+    """Hold group's row lock (the database's write lock on SQLite) until
+    this request commits. Reads after it see what requests that held the
+    lock before have committed."""
+    from sqlalchemy.orm import object_session
+
+    table = type(group).__table__
+    object_session(group).execute(
+        table.update().where(table.c.id == group.id).values(barriers=table.c.barriers)
+    )
@@ -0,0 +1,59 @@
+"""
+Helpers shared by the treatment apps' bots (their tests.py).
+
+decide() yields the submissions of a decision page. With sync='pair' or
+live_decisions it also submits the pages too early, while the partner has
+not chosen yet, and expects oTree to reject them:
+
+    yield from bots.decide(self, Decision, PairWaitPage, cooperate)
+"""
+from otree.api import Submission, SubmissionMustFail
+
+from common import core
+
+
+def wants_to_cooperate(case, participant):
+    if case == 'mixed':
+        return participant.id_in_session % 2 == 0
+    return case == 'cooperate'
+
+
+def send_live(page, player, data):
+    """Send data to page's live_method like player's browser would."""
+    import asyncio
+    from otree.database import db
+    from otree.live import call_live_method_compat
+
+    async def send():
+        async for _ in call_live_method_compat(page.live_method, player, data):
+            pass
+
+    asyncio.run(send())
+    db.commit()
+
+
+def decide(bot, page, pair_wait_page, cooperate):
+    # bots take turns in the order of id_in_session, one submission each turn. The partner with the
+    # higher id chooses one turn late, so the other one's early submit comes while the partner has
+    # not chosen yet; every bot makes the same number of submissions, so the pairs stay in step
+    player = bot.player
+    first = player.id_in_group < core.other_player(player)
+    if core.live_decisions(player.session):
+        # the choice goes over the live channel; the page can only be submitted once the pair is resolved
+        if not first:
+            send_live(page, bot.player, dict(cooperate=cooperate))
+        yield SubmissionMustFail(page)
+        if first:
+            send_live(page, bot.player, dict(cooperate=cooperate))
+        yield page
+    elif core.pair_sync(player.session):
+        if first:
+            yield page, dict(cooperate=cooperate)
+            yield SubmissionMustFail(pair_wait_page, check_html=False)
+        else:
+            yield SubmissionMustFail(page) #no choice made
+            yield page, dict(cooperate=cooperate)
+        # submitted by its live channel in the browser
+        yield Submission(pair_wait_page, check_html=False)
+    else:
+        yield page, dict(cooperate=cooperate)
@@ -0,0 +1,463 @@
+"""
+Game logic shared by the prisoner's dilemma apps: roles, matching in pairs,
+payoffs and the part II vote.
+
+The apps keep their own models and pages and call these functions from thin
+wrappers, e.g. ResultsWaitPage runs set_payoffs(group), which calls
+core.set_payoffs(group, C, PAYOFF_TABLE); their decision pages and
+PairWaitPage subclass DecisionPage and PairWaitPage below. What differs
+between the apps is declared in their C:
+
+    NUM_RICH       players per group with the rich (doubled) payoffs; 0 = equal pay
+    VOTE_SCHEME    how the part II vote is counted, see common/voting.py:
+                   'equal', or 'shares' / 'quadratic' in apps where players
+                   buy additional shares
+    TRACK_HISTORY  keep running totals and the Results/Summary history
+
+The group layout comes from the session config, with C as the default
+(C.PLAYERS_PER_GROUP is None so that oTree leaves the grouping to
+creating_session):
+
+    players_per_group  any even number (C.GROUP_SIZE)
+    rich_per_group     only in apps with NUM_RICH > 0 (C.NUM_RICH)
+    pairing            'random': new partner every round, 'fixed': the same
+                       partner in every round (C.PAIRING)
+    vote_scheme        'shares' or 'quadratic' in apps that sell shares
+                       (C.VOTE_SCHEME)
+    random_seed        seeds all draws of the session; a random seed is used
+                       (and saved in session.random_seed) if it is not set
+    sync               'group': everyone waits on ResultsWaitPage every round;
+                       'pair': payoffs are set per matched pair and a pair
+                       only waits for itself on PairWaitPage (default 'group').
+                       The whole group still meets on VoteWaitPage.
+    live_decisions     True: partners send their choices over the decision
+                       pages' live_method and go on to Results as soon as
+                       both have chosen; implies sync='pair' (default False)
+
+All randomness of a session comes from one NumPy generator in
+creating_session: pairings, roles and the vote round's coin flips are drawn
+there in batches, so a session replayed with the same seed, participants
+and decisions has bit-identical outcomes.
+"""
+import itertools
+from collections import namedtuple
+
+from otree.api import Currency as cu
+
+from common import barrier, history, matching, monitor, payoffs
+from common.flow import Page
+
+# treatments of part II under which the group keeps playing Game A
+GAME_A_TREATMENTS = ('EndoNo', 'ExoNo')
+# treatments drawn by the computer, overriding the vote
+EXOGENOUS_TREATMENTS = ('ExoYes', 'ExoNo')
+
+
+def part2_game(treatment):
+    """Which payoff table is played in part II under the voted treatment."""
+    return payoffs.GAME_A if treatment in GAME_A_TREATMENTS else payoffs.GAME_B
+
+
+def charges_vote_cost(treatment):
+    """Purchased shares are only paid for if the vote was not overridden."""
+    return treatment not in EXOGENOUS_TREATMENTS
+
+
+PAIRING_SCHEMES = ('random', 'fixed')
+SYNC_MODES = ('group', 'pair')
+
+Layout = namedtuple('Layout', ['group_size', 'num_rich', 'pairing'])
+
+
+def layout(session, C):
+    config = session.config
+    return Layout(
+        group_size=config.get('players_per_group', C.GROUP_SIZE),
+        num_rich=config.get('rich_per_group', C.NUM_RICH) if C.NUM_RICH else 0,
+        pairing=config.get('pairing', C.PAIRING),
+    )
+
+
+def buys_shares(C):
+    """Whether players can buy additional vote shares in this app."""
+    return C.VOTE_SCHEME != 'equal'
+
+
+def vote_scheme(session, C):
+    return session.config.get('vote_scheme', C.VOTE_SCHEME)
+
+
+def check_vote_scheme(scheme, C):
+    """Raise ValueError unless the app can run a vote counted by scheme:
+    'equal' in apps without share purchases, a share scheme in the others."""
+    from common import voting
+
+    if scheme not in voting.SCHEMES or (scheme == 'equal') != (not buys_shares(C)):
+        raise ValueError('vote_scheme {!r} is not available in this app'.format(scheme))
+
+
+def creating_session(subsession, C):
+    """Form the groups and draw roles and pairings of every round at once.
+
+    Nothing here depends on what players do, so it is all done in round 1's
+    creating_session instead of on wait pages before every Decision.
+    """
+    if subsession.round_number > 1:
+        return #set up together with round 1
+    group_size, num_rich, pairing = layout(subsession.session, C)
+    num_players = len(subsession.get_players())
+    # NumPy and the vote tally are imported by the functions that use them, to keep app import time low
+    import numpy as np
+    from common import voting
+
+    if group_size < 2 or group_size % 2:
+        raise ValueError('players_per_group must be an even number, not {}'.format(group_size))
+    if num_players % group_size:
+        raise ValueError('{} participants cannot be divided into groups of {}'.format(num_players, group_size))
+    if not 0 <= num_rich <= group_size:
+        raise ValueError('rich_per_group must be between 0 and {}'.format(group_size))
+    if pairing not in PAIRING_SCHEMES:
+        raise ValueError('pairing must be one of {}'.format(', '.join(PAIRING_SCHEMES)))
+    if subsession.session.config.get('sync', 'group') not in SYNC_MODES:
+        raise ValueError('sync must be one of {}'.format(', '.join(SYNC_MODES)))
+    check_vote_scheme(vote_scheme(subsession.session, C), C)
+
+    num_groups = num_players // group_size
+    seed = subsession.session.config.get('random_seed')
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    subsession.session.random_seed = seed
+    monitor.start(subsession.session, C)
+    rng = np.random.default_rng(seed)
+    num_draws = 1 if pairing == 'fixed' else C.NUM_ROUNDS
+    pair, partners = matching.random_pairs(rng, (num_draws, num_groups), group_size)
+    labels = [matching.subgroup_label(k) for k in range(group_size // 2)]
+    # roles are kept for the whole session; a random permutation's values below num_rich mark the rich
+    rich = np.argsort(rng.random((num_groups, group_size)), axis=-1) < num_rich
+    coin_flips = voting.encode_coin_flips(rng.random((num_groups, 2)) < 0.5)
+
+    for subsession_in_round in subsession.in_rounds(1, C.NUM_ROUNDS):
+        players = subsession_in_round.get_players()
+        matrix = [players[k:k + group_size] for k in range(0, num_players, group_size)]
+        subsession_in_round.set_group_matrix(matrix)
+        draw = 0 if pairing == 'fixed' else subsession_in_round.round_number - 1
+        for group, group_players, group_pair, group_partners, group_rich, group_coin_flips in zip(
+            subsession_in_round.get_groups(), matrix, pair[draw], partners[draw], rich, coin_flips
+        ):
+            group.pairing = matching.encode_pairing(group_partners + 1)
+            if subsession_in_round.round_number == C.VOTE_ROUND:
+                group.coin_flips = int(group_coin_flips)
+            for p, k, partner, is_rich in zip(group_players, group_pair, group_partners, group_rich):
+                p.subgroup = labels[k]
+                p.opponent_id = int(partner) + 1
+                if C.NUM_RICH:
+                    p.player_role = 'rich' if is_rich else 'poor'
+
+
+def other_player(player):
+    return player.opponent_id #drawn for every round in creating_session
+
+
+# how roles are shown to participants
+ROLE_TYPES = dict(
+    rich=dict(label='type 1', color='Tomato'),
+    poor=dict(label='type 2', color='DodgerBlue'),
+)
+
+
+def decision_vars(player, C, table):
+    """vars_for_template of Decision and DecisionAfterVote.
+
+    Picks the one payoff table variant for this player's role, the
+    opponent's role and the game of this round, for global/DecisionTable.html.
+    """
+    opponent = player.group.get_player_by_id(other_player(player))
+    part1 = player.round_number < C.VOTE_ROUND
+    game = payoffs.GAME_A if part1 else part2_game(player.group.treatment)
+    if C.NUM_RICH:
+        role, opponent_role = player.player_role, opponent.player_role
+    else:
+        role = opponent_role = 'poor'
+    return dict(
+        opponent=opponent,
+        opponent_role=opponent_role,
+        my_type=ROLE_TYPES[role] if C.NUM_RICH else None,
+        partner_type=ROLE_TYPES[opponent_role],
+        part1=part1,
+        live=live_decisions(player.session),
+        decision=payoffs.decision_table(table, payoffs.role_index(role), payoffs.role_index(opponent_role), game),
+    )
+
+
+def live_decisions(session):
+    return bool(session.config.get('live_decisions', False))
+
+
+def pair_sync(session):
+    """Whether payoffs are set per pair instead of on ResultsWaitPage."""
+    return live_decisions(session) or session.config.get('sync', 'group') == 'pair'
+
+
+def partner_pending(player):
+    """Whether player or their partner has not chosen yet in this round."""
+    opponent = player.group.get_player_by_id(other_player(player))
+    return player.field_maybe_none('cooperate') is None or opponent.field_maybe_none('cooperate') is None
+
+
+WAIT_FOR_PARTNER = 'Please wait until your partner has made a choice.'
+
+
+def decision_live_method(player, data, C, table):
+    """live_method of Decision and DecisionAfterVote.
+
+    With live_decisions on, a player sends {'cooperate': true/false}; when
+    the partner has already chosen, the pair's payoffs are set right away and
+    both are told to submit the page. {} asks for the current state, e.g.
+    after a reconnect.
+    """
+    if not live_decisions(player.session):
+        return
+    opponent = player.group.get_player_by_id(other_player(player))
+    if player.field_maybe_none('cooperate') is None and 'cooperate' in data:
+        player.cooperate = bool(data['cooperate'])
+        if resolve_pair(player, opponent, C, table):
+            return {p.id_in_group: dict(chosen=True, resolved=True, cooperate=p.cooperate) for p in (player, opponent)}
+    cooperate = player.field_maybe_none('cooperate')
+    if cooperate is None:
+        return {player.id_in_group: dict(chosen=False)}
+    # with live_decisions on, choices are only stored here, so both being set means the pair is resolved
+    resolved = opponent.field_maybe_none('cooperate') is not None
+    return {player.id_in_group: dict(chosen=True, resolved=resolved, cooperate=cooperate)}
+
+
+def live_decision_error(player):
+    """error_message of the decision pages: with live_decisions on, the page
+    may only be submitted once the pair has been resolved."""
+    if live_decisions(player.session) and partner_pending(player):
+        return WAIT_FOR_PARTNER
+
+
+def pair_decided(player, C, table):
+    """before_next_page of the decision pages: with sync='pair', the second
+    partner to submit sets the pair's payoffs."""
+    if not pair_sync(player.session) or live_decisions(player.session):
+        return #set on ResultsWaitPage, or already in decision_live_method
+    resolve_pair(player, player.group.get_player_by_id(other_player(player)), C, table)
+
+
+def resolve_pair(player, opponent, C, table):
+    """Set the pair's payoffs if opponent has chosen too; player's choice is set.
+    Returns whether both have chosen.
+
+    The partners' requests may run at the same time in different web
+    processes. Each takes the group's row lock before reading the other's
+    choice, so the second one to get it sees the first one's choice and sets
+    the payoffs, and the claim keeps them from being set twice.
+    """
+    from sqlalchemy.orm import object_session
+
+    group = player.group
+    barrier.lock(group)
+    object_session(opponent).refresh(opponent, ['cooperate'])
+    if opponent.field_maybe_none('cooperate') is None:
+        return False
+    if barrier.claim(group, 'pair-{}'.format(min(player.id_in_group, opponent.id_in_group))):
+        set_pair_payoffs(player, opponent, C, table)
+    return True
+
+
+def pair_wait_live_method(player, data):
+    """live_method of PairWaitPage: once the partner has chosen, both
+    partners are told to move on."""
+    if partner_pending(player):
+        return {player.id_in_group: dict(ready=False)}
+    opponent_id = other_player(player)
+    return {player.id_in_group: dict(ready=True), opponent_id: dict(ready=True)}
+
+
+def pair_wait_error(player):
+    if partner_pending(player):
+        return WAIT_FOR_PARTNER
+
+
+class DecisionPage(Page):
+    """Base of the apps' Decision and DecisionAfterVote pages, with the hooks
+    above. A subclass adds is_displayed and names its app's C and table:
+
+        class Decision(core.DecisionPage):
+            constants = C
+            payoff_table = PAYOFF_TABLE
+    """
+    form_model = 'player'
+    constants = None
+    payoff_table = None
+
+    @staticmethod
+    def get_form_fields(player):
+        if live_decisions(player.session):
+            # chosen over the live channel; a submitted value could differ from the one the payoffs were set with
+            return []
+        return ['cooperate']
+
+    @classmethod
+    def vars_for_template(cls, player):
+        return decision_vars(player, cls.constants, cls.payoff_table)
+
+    @classmethod
+    def live_method(cls, player, data):
+        return decision_live_method(player, data, cls.constants, cls.payoff_table)
+
+    @staticmethod
+    def error_message(player, values):
+        return live_decision_error(player)
+
+    @classmethod
+    def before_next_page(cls, player, timeout_happened):
+        pair_decided(player, cls.constants, cls.payoff_table)
+
+
+class PairWaitPage(Page):
+    """Waits for the partner only, with sync='pair'. Each app subclasses it,
+    as oTree keeps per-app state on its page classes."""
+    template_name = 'global/PairWaitPage.html'
+
+    @staticmethod
+    def is_displayed(player):
+        return pair_sync(player.session) and not live_decisions(player.session)
+
+    @staticmethod
+    def live_method(player, data):
+        return pair_wait_live_method(player, data)
+
+    @staticmethod
+    def error_message(player, values):
+        return pair_wait_error(player)
+
+
+def set_payoffs(group, C, table):
+    if not barrier.claim(group, 'set_payoffs'):
+        return #already run for this group by another web process
+    resolve(group, group.get_players(), matching.partner_positions(group.pairing), C, table)
+
+
+def set_pair_payoffs(player, opponent, C, table):
+    """Payoffs of one matched pair, for sessions that do not wait for the
+    whole group before showing results."""
+    resolve(player.group, [player, opponent], [1, 0], C, table)
+
+
+def set_payoff(player, payoff):
+    """player.payoff = payoff, without the db.commit() of oTree's setter, so
+    that a callback's changes are written in one flush and roll back with its
+    barrier claim if it fails."""
+    payoff = cu(payoff)
+    player.participant.payoff += payoff - player.payoff
+    player._payoff = payoff
+
+
+def load_participants(players):
+    """The participants of players, loaded with one query. While they are
+    referenced, player.participant finds them without a query of its own."""
+    from otree.models import Participant
+
+    return Participant.objects_filter(Participant.id.in_([p.participant_id for p in players])).all()
+
+
+def resolve(group, players, partners, C, table):
+    """Payoffs of players, where partners[k] is the position of player k's
+    partner in players. All results are written by the request's next
+    flush, in one UPDATE per table."""
+    participants = load_participants(players) #referenced while p.participant is read below
+    if group.round_number < C.VOTE_ROUND:
+        game, total_field, first_round = payoffs.GAME_A, 'cum_payoff_game1', 1
+    else:
+        game = part2_game(group.treatment)
+        total_field, first_round = 'cum_payoff_game2', C.VOTE_ROUND
+    if not C.TRACK_HISTORY or group.round_number == first_round:
+        previous_totals = 0
+    else:
+        # running totals are kept on the participant, so no in_round() lookups
+        previous_totals = [getattr(p.participant, total_field) for p in players]
+    if C.NUM_RICH:
+        roles = [payoffs.role_index(p.player_role) for p in players]
+    else:
+        roles = payoffs.POOR
+    group_payoffs, totals = payoffs.resolve_group(
+        table, roles, game, [p.cooperate for p in players], partners, previous_totals
+    )
+    monitor.record_decisions(group, players, C.NAME_IN_URL)
+    if not C.TRACK_HISTORY:
+        for p, payoff in zip(players, group_payoffs):
+            set_payoff(p, payoff)
+        return
+
+    game2_round = round(group.round_number - C.VOTE_ROUND + 1) if group.round_number >= C.VOTE_ROUND else 0
+    for p, partner, payoff, total in zip(players, partners, group_payoffs, totals):
+        opponent = players[partner]
+        participant = p.participant
+        set_payoff(p, payoff)
+        setattr(p, total_field, cu(total))
+        setattr(participant, total_field, cu(total))
+        # fields shown in the Results/Summary history tables
+        p.my_choice = p.field_display('cooperate')
+        p.opponent_choice = opponent.field_display('cooperate')
+        if C.NUM_RICH:
+            p.opponent_type = 'type 1' if opponent.player_role == 'rich' else 'type 2'
+        p.opponent_payoff = cu(group_payoffs[partner])
+        p.game2_round = game2_round
+        history.append(participant, history.Row(
+            group.round_number, game2_round, p.my_choice, p.payoff, p.field_maybe_none('opponent_type'),
+            p.opponent_choice, p.opponent_payoff,
+        ))
+        if group.round_number == C.NUM_ROUNDS:
+            p.final_payoff = participant.cum_payoff_game1 + participant.cum_payoff_game2
+            if buys_shares(C) and charges_vote_cost(group.treatment):
+                p.final_payoff -= participant.additional_vote_share*C.COST_VOTING
+
+
+def vote_totals(group, C):
+    """(votes for Game B, all votes) of a group under the session's vote scheme."""
+    import numpy as np
+    from common import voting
+
+    players = group.get_players()
+    shares = np.array([p.additional_vote_share if buys_shares(C) else 0 for p in players])
+    weights = voting.SCHEMES[vote_scheme(group.session, C)](shares)
+    return float(sum(w for p, w in zip(players, weights) if p.if_vote)), float(weights.sum())
+
+
+def assign_treatment(group, C):
+    if not barrier.claim(group, 'assign_treatment'):
+        return #already run for this group by another web process
+    assign_treatments([group], C)
+
+
+def assign_treatments(groups, C):
+    """Tally the vote of groups (of one subsession) in one call and set their treatments."""
+    from common import voting
+
+    players = [group.get_players() for group in groups]
+    if buys_shares(C):
+        shares = [[p.additional_vote_share for p in group_players] for group_players in players]
+        for p in itertools.chain.from_iterable(players):
+            p.participant.additional_vote_share = p.additional_vote_share #read by Summary without going back to this round
+    else:
+        shares = [[0] * len(group_players) for group_players in players]
+    result = voting.tally(
+        vote_scheme(groups[0].session, C),
+        [[p.if_vote for p in group_players] for group_players in players],
+        shares,
+        [group.coin_flips for group in groups],
+    )
+    for k, (group, group_players, group_shares) in enumerate(zip(groups, players, shares)):
+        # shares voting for Game B; everyone has one share plus the ones they bought
+        group.total_if_vote = sum(share + 1 for p, share in zip(group_players, group_shares) if p.if_vote)
+        if buys_shares(C):
+            group.total_shares = sum(group_shares) + len(group_players)
+        group.if_override = bool(result.override[k])
+        if result.override[k] or result.tie[k]:
+            group.dice = bool(result.dice[k])
+        group.treatment = voting.TREATMENTS[result.treatment[k]]
+        monitor.record_vote(group, group_shares, C.NAME_IN_URL)
+        for g in group.in_rounds(C.VOTE_ROUND + 1, C.NUM_ROUNDS):
+            g.treatment = group.treatment #later rounds play the voted game; set once here instead of on every page render
@@ -0,0 +1,270 @@
+"""
+Tidy per-round export: one row per player and round, with the group's vote
+outcome next to the player's choices.
+
+Each app's custom_export() yields these rows for the admin "Data" page.
+For datasets too large to load at once, stream() reads players in chunks
+from a server-side cursor and writes each CSV row as soon as it is built,
+so memory stays flat and export time is linear in the number of rows:
+
+    python -m common.export equalpay_asyvote -o equalpay_asyvote.csv
+    python -m common.export asypay_equalvote --session abc123de > out.csv
+
+write_parquet() writes the same rows as a typed Parquet dataset instead
+(needs the optional pyarrow package: pip install pyarrow). Files are
+partitioned by app, by the treatment each group voted for and by session,
+hive style (app=equalpay_asyvote/treatment=EndoYes/session=abc123de/part-0.parquet),
+so a notebook can memory-map one treatment without scanning the rest, and
+sessions exported one at a time into the same root do not replace each other:
+
+    python -m common.export equalpay_asyvote --format parquet -o results/
+    python -m common.export equalpay_asyvote --format parquet --session abc123de -o results/
+
+    import pyarrow.dataset as ds
+    data = ds.dataset('results/', partitioning=ds.HivePartitioning.discover(infer_dictionary=True))
+    data.to_table(filter=ds.field('treatment') == 'EndoYes')
+"""
+import argparse
+import csv
+import itertools
+import sys
+
+PLAYER_FIELDS = (
+    'cooperate',
+    'subgroup',
+    'opponent_id',
+    'player_role',
+    'if_vote',
+    'additional_vote_share',
+    'payoff',
+)
+GROUP_FIELDS = ('treatment', 'total_if_vote', 'total_shares', 'if_override', 'dice')
+
+
+def _existing(model, names):
+    # not every app has every field, e.g. total_shares is only in equalpay_asyvote
+    return [name for name in names if hasattr(model, name)]
+
+
+def header(Player, Group):
+    return (
+        ['session', 'participant', 'round_number', 'id_in_group', 'group']
+        + _existing(Player, PLAYER_FIELDS)
+        + _existing(Group, GROUP_FIELDS)
+    )
+
+
+def _preload(players, Group):
+    """Load the groups, participants and sessions of players that are not
+    loaded yet, with one query per model.
+
+    Reading p.group, p.participant or p.session then finds them in the
+    identity map instead of querying once per row, as long as the returned
+    list is referenced.
+    """
+    from sqlalchemy import inspect
+    from sqlalchemy.orm import load_only
+    from otree.database import dbq
+    from otree.models import Participant, Session
+
+    loaded = []
+    for relation, model, key in (
+        ('group', Group, 'group_id'),
+        ('participant', Participant, 'participant_id'),
+        ('session', Session, 'session_id'),
+    ):
+        ids = {getattr(p, key) for p in players if relation in inspect(p).unloaded}
+        if ids:
+            query = dbq(model).filter(model.id.in_(ids))
+            if model is not Group:
+                # only the codes are exported; participant.vars holds every round's history
+                query = query.options(load_only('code'))
+            loaded += query.all()
+    return loaded
+
+
+def tidy_rows(players, Player, Group, chunk_size=1000):
+    """Generator of the header and one row per player-round.
+
+    Groups, participants and sessions are loaded chunk_size players at a
+    time (see _preload) unless the query of players already joined them.
+    """
+    player_fields = _existing(Player, PLAYER_FIELDS)
+    group_fields = _existing(Group, GROUP_FIELDS)
+    yield header(Player, Group)
+    players = iter(players)
+    while True:
+        chunk = list(itertools.islice(players, chunk_size))
+        if not chunk:
+            return
+        loaded = _preload(chunk, Group)  # noqa: F841, referenced while the chunk's rows are built
+        for p in chunk:
+            group = p.group
+            yield (
+                [p.session.code, p.participant.code, p.round_number, p.id_in_group, group.id_in_subsession]
+                + [p.field_maybe_none(name) for name in player_fields]
+                + [group.field_maybe_none(name) for name in group_fields]
+            )
+
+
+def player_query(Player, session_code=None, chunk_size=1000):
+    """All players of an app in id order, fetched chunk_size at a time.
+
+    yield_per() makes SQLAlchemy use a server-side cursor on PostgreSQL
+    (stream_results), so rows are not buffered by the driver either.
+    """
+    from sqlalchemy.orm import joinedload
+    from otree.database import dbq
+    from otree.models import Session
+
+    query = dbq(Player).order_by(Player.id)
+    if session_code:
+        session = Session.objects_get(code=session_code)
+        query = query.filter(Player.session_id == session.id)
+    return query.options(
+        # only the codes are exported; participant.vars holds every round's history
+        joinedload(Player.participant, innerjoin=True).load_only('code'),
+        joinedload(Player.session, innerjoin=True).load_only('code'),
+        joinedload(Player.group, innerjoin=True),
+    ).yield_per(chunk_size)
+
+
+def stream(app_name, fp, session_code=None, chunk_size=1000):
+    """Write the tidy export of one app to fp, row by row."""
+    from otree.common import get_models_module
+    from otree.export import sanitize_for_csv
+
+    app = get_models_module(app_name)
+    writer = csv.writer(fp)
+    players = player_query(app.Player, session_code, chunk_size)
+    for row in tidy_rows(players, app.Player, app.Group, chunk_size):
+        writer.writerow([sanitize_for_csv(value) for value in row])
+
+
+def arrow_schema(columns):
+    """Arrow types of the tidy columns, plus the app/treatment partition keys."""
+    import pyarrow as pa
+
+    code = pa.dictionary(pa.int32(), pa.string())
+    types = dict(
+        session=code,  # a partition key as well, see write_parquet
+        participant=pa.string(),
+        round_number=pa.int32(),
+        id_in_group=pa.int32(),
+        group=pa.int32(),
+        cooperate=pa.bool_(),
+        subgroup=code,
+        opponent_id=pa.int32(),
+        player_role=code,
+        if_vote=pa.bool_(),
+        additional_vote_share=pa.int32(),
+        payoff=pa.field('payoff', pa.float64(), metadata={'otree_type': 'Currency'}),
+        total_if_vote=pa.int32(),
+        total_shares=pa.int32(),
+        if_override=pa.bool_(),
+        dice=pa.bool_(),
+        # partition keys; not stored in the files, dictionary-encoded on read
+        app=pa.string(),
+        treatment=pa.string(),
+    )
+    fields = [types[name] if isinstance(types[name], pa.Field) else pa.field(name, types[name]) for name in columns]
+    return pa.schema(fields)
+
+
+def voted_treatments(app, session_code=None):
+    """(session code, group id_in_subsession) -> treatment of the vote round,
+    of one session or (without session_code) all of them.
+
+    Groups keep the same members in every round, so Part I rows are filed
+    under the treatment their group went on to vote for.
+    """
+    from otree.database import dbq
+    from otree.models import Session
+
+    Group = app.Group
+    query = (
+        dbq(Session.code, Group.id_in_subsession, Group.treatment)
+        .join(Session, Group.session_id == Session.id)
+        .filter(Group.round_number == int(app.C.VOTE_ROUND))
+    )
+    if session_code:
+        query = query.filter(Session.code == session_code)
+    return {(code, group): treatment for code, group, treatment in query}
+
+
+def record_batches(app_name, schema, rows, treatments, chunk_size):
+    import pyarrow as pa
+
+    header = next(rows)
+    session, group, treatment = (header.index(name) for name in ('session', 'group', 'treatment'))
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        columns = {name: [row[i] for row in chunk] for i, name in enumerate(header)}
+        columns['payoff'] = [None if value is None else float(value) for value in columns['payoff']]
+        columns['treatment'] = [
+            row[treatment] or treatments.get((row[session], row[group])) for row in chunk
+        ]
+        columns['app'] = [app_name] * len(chunk)
+        yield pa.RecordBatch.from_pydict(columns, schema=schema)
+
+
+def write_parquet(app_name, root, session_code=None, chunk_size=10000):
+    """Write the tidy export of one app to a Parquet dataset under root.
+
+    Every session exported again overwrites the files of its own partitions;
+    files of other sessions are left alone."""
+    import pyarrow.dataset as ds
+    from otree.common import get_models_module
+
+    app = get_models_module(app_name)
+    rows = tidy_rows(player_query(app.Player, session_code, chunk_size), app.Player, app.Group, chunk_size)
+    schema = arrow_schema(header(app.Player, app.Group) + ['app'])
+    ds.write_dataset(
+        record_batches(app_name, schema, rows, voted_treatments(app, session_code), chunk_size),
+        root,
+        schema=schema,
+        format='parquet',
+        partitioning=['app', 'treatment', 'session'],
+        partitioning_flavor='hive',
+        existing_data_behavior='overwrite_or_ignore',
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('app_name')
+    parser.add_argument('--session', help='session code; all sessions if omitted')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('-o', '--output', help='CSV file (stdout if omitted) or Parquet dataset directory')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.format == 'parquet':
+        if not args.output:
+            parser.error('--format parquet needs an output directory (-o)')
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            sys.exit('Parquet export needs pyarrow: pip install pyarrow')
+
+    from otree.main import setup
+    from otree.database import session_scope
+
+    setup()
+    if args.format == 'parquet':
+        with session_scope():
+            write_parquet(args.app_name, args.output, args.session, args.chunk_size)
+        return
+    fp = open(args.output, 'w', newline='', encoding='utf8') if args.output else sys.stdout
+    try:
+        with session_scope():
+            stream(args.app_name, fp, args.session, args.chunk_size)
+    finally:
+        if args.output:
+            fp.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Page and WaitPage base classes that skip hidden pages in one step.
+
+When a page is submitted (or found hidden on a GET), oTree looks for the
+next page to show one page at a time: for every page in between it loads
+the player with a query of its own, calls is_displayed, and sets the
+participant's position, which the next query flushes. A hidden wait page
+also commits and counts the group's arrivals. From Decision to the next
+round's Decision in part I, or from Results to the next DecisionAfterVote
+in part II, that is 8 to 10 hidden pages and about 20 statements per submit.
+
+The pages of these apps derive from the classes below instead:
+
+    from otree.api import *
+    from common.flow import Page, WaitPage
+
+They walk the following pages with the same is_displayed, but load the
+player once per round and set the participant's position once, at the page
+they stop at. They stop early, and leave the rest to oTree's walk (the GET
+of the page they stop at skips it if hidden), at a page of another app or
+one that derives from oTree's classes directly. A page that defines
+app_after_this_page is left to oTree altogether.
+
+Hidden wait pages are skipped without counting the group's arrivals. That
+is only right if a wait page's is_displayed is the same for all players of
+a group (e.g. it depends on the round or the session config), so that
+nobody can be waiting on a page the others skip. The wait pages of these
+apps are.
+"""
+from otree.api import Page as OTreePage, WaitPage as OTreeWaitPage
+
+
+class SkipsHiddenPages:
+    def _increment_index_in_pages(self):
+        from otree.lookup import get_page_lookup
+
+        if hasattr(self, 'app_after_this_page'):
+            return super()._increment_index_in_pages()
+        participant = self.participant
+        players = {self.round_number: self.player}
+        for page_index in range(self._index_in_pages + 1, participant._max_page_index + 1):
+            lookup = get_page_lookup(participant._session_code, page_index)
+            page = lookup.page_class
+            if lookup.app_name != self._lookup.app_name or not issubclass(page, SkipsHiddenPages):
+                break
+            player = players.get(lookup.round_number)
+            if player is None:
+                player = players[lookup.round_number] = self.PlayerClass.objects_get(
+                    participant=participant, round_number=lookup.round_number
+                )
+            if page.is_displayed(player):
+                break
+        else:
+            page_index = participant._max_page_index + 1 #past the last page, as in oTree
+        participant._index_in_pages = page_index
+
+
+class Page(SkipsHiddenPages, OTreePage):
+    pass
+
+
+class WaitPage(SkipsHiddenPages, OTreeWaitPage):
+    pass
@@ -0,0 +1,64 @@
+"""
+Cache of the rendered instruction pages.
+
+Game1Instructions, VoteForGame2Instructions and Game2Instructions only
+depend on C, the session's group layout, the player's role and (in part II)
+the group's treatment. Their bodies live in <Page>_body.html partials that
+see nothing but those values, so each variant is rendered once per session
+and served as a string to everyone else with the same role and treatment:
+
+    {{ instructions }}    in the page template, with
+    instructions=fragments.render(player, C, 'app/Page_body.html', role=..., treatment=...)
+
+Fragments are kept per session code and dropped once every participant of
+the session is past the last instruction page (see release()). At most
+MAX_SESSIONS sessions are kept, so sessions that never finish, e.g. demo
+sessions, do not pile up: past that, the least recently rendered session's
+fragments are dropped. Its count of released participants is kept, so if
+they are rendered again, release() still drops them when the session is done.
+"""
+from collections import OrderedDict
+
+MAX_SESSIONS = 16
+
+_fragments = OrderedDict() #session code -> {(template, role, treatment): html}
+_released = {} #session code -> participants past the last instruction page
+
+
+def render(player, C, template, role=None, treatment=None, **context):
+    """HTML of template for this role and treatment, rendered once per session.
+
+    context must only hold values that are the same for the whole session,
+    such as the group layout.
+    """
+    code = player.session.code
+    fragments = _fragments.get(code)
+    if fragments is None:
+        fragments = _fragments[code] = {}
+        while len(_fragments) > MAX_SESSIONS:
+            _fragments.popitem(last=False) #least recently rendered
+    else:
+        _fragments.move_to_end(code)
+    key = (template, role, treatment)
+    html = fragments.get(key)
+    if html is None:
+        from otree.templating import ibis_loader
+
+        html = ibis_loader.load(template).render(dict(context, C=C, role=role, treatment=treatment))
+        fragments[key] = html
+    return html
+
+
+def release(player):
+    """Call from before_next_page of the last instruction page."""
+    session = player.session
+    released = _released.get(session.code, 0) + 1
+    if released >= session.num_participants:
+        evict(session.code)
+    else:
+        _released[session.code] = released
+
+
+def evict(code):
+    _fragments.pop(code, None)
+    _released.pop(code, None)
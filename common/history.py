@@ -0,0 +1,25 @@
+"""
+Per-participant history of played rounds, kept in participant.history.
+
+set_payoffs appends one small tuple per round, so the Results and Summary
+tables are rendered from the participant without loading the player rows of
+earlier rounds.
+"""
+from collections import namedtuple
+
+Row = namedtuple(
+    'Row',
+    ['round_number', 'game2_round', 'my_choice', 'payoff', 'opponent_type', 'opponent_choice', 'opponent_payoff'],
+)
+
+
+def append(participant, row: Row):
+    if row.round_number == 1:
+        participant.history = [tuple(row)]
+    else:
+        participant.history.append(tuple(row))
+
+
+def rounds(participant, first, last):
+    """Rows for rounds first..last (inclusive) that have been played so far."""
+    return [Row._make(row) for row in participant.history if first <= row[0] <= last]
@@ -0,0 +1,172 @@
+"""
+Wall time and ORM query count of the page hooks, per page.
+
+Off unless the OTREE_PAGE_TIMING environment variable is set, e.g.
+
+    OTREE_PAGE_TIMING=1 otree devserver
+
+When it is off, pages() returns the page_sequence untouched, so there is
+no cost at all. When it is on, every hook a page defines itself or inherits from
+a base class of the project, such as common/core.py's DecisionPage
+(is_displayed, vars_for_template, error_message, before_next_page,
+live_method and the wait pages' after_all_players_arrive), is wrapped to
+measure each call, and a SQLAlchemy listener counts the statements sent to
+the database. Queries of lazily loaded players and groups are counted in
+the hook that loads them; the writes oTree flushes at the end of the
+request are not counted at all.
+
+The last SAMPLES calls of every (app, page, hook) are kept in memory, in
+the process that served them. The apps' admin reports show them as
+histograms over BUCKETS_MS, with a CSV download of the latest CSV_SAMPLES
+raw samples of each hook. The download is embedded in the report, which is
+rendered again on every refresh, so it stays a few hundred kB at most;
+csv_text() without a limit returns all of them.
+"""
+import csv
+import functools
+import inspect
+import io
+import os
+import time
+from collections import deque
+
+ENABLED = bool(os.environ.get('OTREE_PAGE_TIMING'))
+HOOKS = (
+    'is_displayed',
+    'vars_for_template',
+    'error_message',
+    'before_next_page',
+    'live_method',
+    'after_all_players_arrive',
+)
+SAMPLES = 2000 #calls kept per (app, page, hook)
+CSV_SAMPLES = 100 #latest calls per (app, page, hook) in the admin report's CSV download
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000) #upper bounds; the last bucket is open
+
+_samples = {} #(app, page, hook) -> deque of (ms, queries)
+_queries = [0]
+_listening = []
+
+
+def _count_query(*args):
+    _queries[0] += 1
+
+
+def _listen():
+    if _listening:
+        return
+    from sqlalchemy import event
+    from otree.database import engine
+
+    event.listen(engine, 'before_cursor_execute', _count_query)
+    _listening.append(engine)
+
+
+def _timed(func, key):
+    samples = _samples.setdefault(key, deque(maxlen=SAMPLES))
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        queries = _queries[0]
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            samples.append(((time.perf_counter() - start) * 1000, _queries[0] - queries))
+
+    return wrapper
+
+
+def _hook(page, name):
+    """page's hook name, unless it is oTree's default or not set."""
+    for cls in page.__mro__:
+        if cls.__module__.split('.')[0] == 'otree':
+            return None
+        if name in cls.__dict__:
+            return getattr(page, name) #the function of a staticmethod, bound to page for a classmethod
+    return None
+
+
+def pages(app_name, page_sequence):
+    """Wrap the hooks of page_sequence if OTREE_PAGE_TIMING is set.
+
+    Call at the end of an app's __init__.py:
+        page_sequence = instrument.pages(C.NAME_IN_URL, page_sequence)
+    """
+    if not ENABLED:
+        return page_sequence
+    _listen()
+    for page in page_sequence:
+        for hook in HOOKS:
+            func = _hook(page, hook)
+            #after_all_players_arrive may name a group method; async live methods are left alone
+            if not inspect.isroutine(func) or inspect.isasyncgenfunction(func):
+                continue
+            setattr(page, hook, staticmethod(_timed(func, (app_name, page.__name__, hook))))
+    return page_sequence
+
+
+def _percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summary(app_name):
+    """One dict per hook of app_name that was called, in page order."""
+    rows = []
+    for (app, page, hook), samples in list(_samples.items()):
+        if app != app_name or not samples:
+            continue
+        ms = sorted(sample[0] for sample in samples)
+        queries = [sample[1] for sample in samples]
+        histogram = [0] * (len(BUCKETS_MS) + 1)
+        for value in ms:
+            i = 0
+            while i < len(BUCKETS_MS) and value > BUCKETS_MS[i]:
+                i += 1
+            histogram[i] += 1
+        rows.append(dict(
+            page=page,
+            hook=hook,
+            calls=len(ms),
+            mean_ms=round(sum(ms) / len(ms), 2),
+            p50_ms=round(_percentile(ms, 0.5), 2),
+            p95_ms=round(_percentile(ms, 0.95), 2),
+            max_ms=round(ms[-1], 2),
+            mean_queries=round(sum(queries) / len(queries), 1),
+            max_queries=max(queries),
+            histogram=histogram,
+        ))
+    return rows
+
+
+def csv_text(app_name=None, last=None):
+    """Raw samples as CSV, of all apps if app_name is None, and only the
+    latest `last` of each hook if it is given."""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['app', 'page', 'hook', 'ms', 'queries'])
+    for (app, page, hook), samples in list(_samples.items()):
+        if app_name is None or app == app_name:
+            samples = list(samples)
+            for ms, queries in samples[-last:] if last else samples:
+                writer.writerow([app, page, hook, round(ms, 3), queries])
+    return out.getvalue()
+
+
+def admin_report_vars(app_name):
+    """Variables of global/PageTiming.html."""
+    from urllib.parse import quote
+
+    return dict(
+        timing_enabled=ENABLED,
+        timing_rows=summary(app_name),
+        timing_buckets=[f'<= {ms}' for ms in BUCKETS_MS] + [f'> {BUCKETS_MS[-1]}'],
+        timing_csv='data:text/csv;charset=utf-8,' + quote(csv_text(app_name, CSV_SAMPLES)),
+        timing_samples=SAMPLES,
+        timing_csv_samples=CSV_SAMPLES,
+    )
+
+
+def reset():
+    for samples in _samples.values():
+        samples.clear()
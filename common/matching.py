@@ -0,0 +1,60 @@
+"""
+Random matching of a group's players into 2-player subgroups.
+
+The pairing of a round is stored on the group as a compact string, the
+partner's id_in_group for each player in id_in_group order, e.g. '3,4,1,2'.
+Pages and payoff code read it instead of scanning the group for the player
+with the same subgroup label.
+
+random_pairs() draws the pairings of many groups and rounds at once with
+NumPy: one shuffle per group and round, O(N), for any even group size.
+NumPy is only imported there, so importing an app stays cheap.
+"""
+import string
+
+SUBGROUP_LABELS = string.ascii_uppercase
+
+
+def subgroup_label(k):
+    """'A'..'Z', then 'AA', 'AB', ... for groups of more than 52 players."""
+    label = ''
+    k += 1
+    while k:
+        k, rest = divmod(k - 1, len(SUBGROUP_LABELS))
+        label = SUBGROUP_LABELS[rest] + label
+    return label
+
+
+def random_pairs(rng, shape, group_size):
+    """Shuffle every group and pair off consecutive players.
+
+    shape is the leading shape, e.g. (num_rounds, num_groups). Returns
+    (pair, partners), integer arrays of shape + (group_size,) indexed by
+    position in the group (id_in_group - 1): the 0-based pair number, which
+    gives the subgroup label, and the position of the partner.
+    """
+    import numpy as np
+
+    if group_size % 2:
+        raise ValueError('Cannot match {} players in pairs'.format(group_size))
+    shape = tuple(shape) + (group_size,)
+    order = np.argsort(rng.random(shape), axis=-1)
+    partners = np.empty_like(order)
+    np.put_along_axis(partners, order[..., 0::2], order[..., 1::2], axis=-1)
+    np.put_along_axis(partners, order[..., 1::2], order[..., 0::2], axis=-1)
+    pair = np.empty_like(order)
+    np.put_along_axis(pair, order, np.broadcast_to(np.arange(group_size) // 2, shape), axis=-1)
+    return pair, partners
+
+
+def encode_pairing(partners):
+    return ','.join(str(partner) for partner in partners)
+
+
+def decode_pairing(pairing):
+    return [int(partner) for partner in pairing.split(',')]
+
+
+def partner_positions(pairing):
+    """Partner of each player as a 0-based position in group.get_players()."""
+    return [partner - 1 for partner in decode_pairing(pairing)]
@@ -0,0 +1,164 @@
+"""
+Running counts of a session, for the apps' admin reports.
+
+Payoffs (set_payoffs, or the pair resolution of sync='pair') and the vote
+(assign_treatment) add to counters in two small tables of their own as they
+are computed, so the admin report reads a few rows instead of scanning the
+player rows of the whole session:
+
+    DecisionCount  (round, role, treatment) -> players, cooperators
+    VoteCount      treatment -> groups, voters, players who bought shares, shares bought
+
+role is None in apps without rich and poor players and treatment is None in
+part I. start() inserts one row per key when the session is created, so
+there are at most rounds x roles x treatments rows per app, and an update is
+one UPDATE ... SET n = n + :k per key. A missing row is inserted instead.
+The session row is never written, so groups completing at the same time in
+different web processes only wait for each other on the counter rows they
+share, and only until the request commits.
+"""
+from otree.api import ExtraModel, models
+from otree.models import Session
+
+
+class DecisionCount(ExtraModel):
+    session = models.Link(Session)
+    app = models.StringField()
+    round_number = models.IntegerField()
+    role = models.StringField()
+    treatment = models.StringField()
+    players = models.IntegerField(initial=0)
+    cooperators = models.IntegerField(initial=0)
+
+
+class VoteCount(ExtraModel):
+    session = models.Link(Session)
+    app = models.StringField()
+    treatment = models.StringField()
+    groups = models.IntegerField(initial=0)
+    voters = models.IntegerField(initial=0)
+    buyers = models.IntegerField(initial=0)
+    shares = models.IntegerField(initial=0)
+
+
+def start(session, C):
+    """Call from creating_session, once per app."""
+    from common import voting
+
+    app_name = C.NAME_IN_URL
+    session.monitor = (session.vars.get('monitor') or []) + [app_name]
+    roles = ['rich', 'poor'] if C.NUM_RICH else [None]
+    vote_round = getattr(C, 'VOTE_ROUND', C.NUM_ROUNDS + 1)
+    for round_number in range(1, C.NUM_ROUNDS + 1):
+        for role in roles:
+            for treatment in voting.TREATMENTS if round_number >= vote_round else [None]:
+                DecisionCount.create(
+                    session=session, app=app_name, round_number=round_number, role=role, treatment=treatment
+                )
+    for treatment in voting.TREATMENTS:
+        VoteCount.create(session=session, app=app_name, treatment=treatment)
+
+
+def enabled(session, app_name):
+    #_vars, as reading session.vars marks the session row as changed
+    return app_name in (session._vars.get('monitor') or []) #False for sessions created before the monitor existed
+
+
+def _add(model, session, key, **amounts):
+    """UPDATE model's row of key, adding amounts to its counters, or insert it if missing."""
+    from sqlalchemy import and_
+    from sqlalchemy.orm import object_session
+
+    table = model.__table__
+    db = object_session(session)
+    where = [table.c.session_id == session.id] + [table.c[name] == value for name, value in key.items()]
+    result = db.execute(
+        table.update().where(and_(*where)).values({name: table.c[name] + amount for name, amount in amounts.items()})
+    )
+    if result.rowcount == 0:
+        model.create(session=session, **key, **amounts)
+
+
+def record_decisions(group, players, app_name):
+    session = group.session
+    if not enabled(session, app_name):
+        return
+    treatment = group.field_maybe_none('treatment')
+    counts = {}
+    for p in players:
+        role_counts = counts.setdefault(p.field_maybe_none('player_role'), [0, 0])
+        role_counts[0] += 1
+        role_counts[1] += bool(p.cooperate)
+    for role, (num_players, num_cooperators) in sorted(counts.items(), key=lambda item: str(item[0])):
+        _add(
+            DecisionCount, session,
+            dict(app=app_name, round_number=group.round_number, role=role, treatment=treatment),
+            players=num_players, cooperators=num_cooperators,
+        )
+
+
+def record_vote(group, shares, app_name):
+    """shares: the additional shares of each player, 0 where none can be bought."""
+    session = group.session
+    if not enabled(session, app_name):
+        return
+    _add(
+        VoteCount, session, dict(app=app_name, treatment=group.treatment),
+        groups=1, voters=len(shares), buyers=sum(1 for share in shares if share), shares=sum(shares),
+    )
+
+
+def decisions(session, app_name):
+    """{(round, role, treatment): (players, cooperators)} of the session so far."""
+    from otree.database import db
+
+    rows = db.query(
+        DecisionCount.round_number, DecisionCount.role, DecisionCount.treatment,
+        DecisionCount.players, DecisionCount.cooperators,
+    ).filter(DecisionCount.session_id == session.id, DecisionCount.app == app_name, DecisionCount.players > 0)
+    return {tuple(row[:3]): tuple(row[3:]) for row in rows}
+
+
+def votes(session, app_name):
+    """{treatment: (groups, voters, buyers, shares)} of the session so far."""
+    from otree.database import db
+
+    rows = db.query(
+        VoteCount.treatment, VoteCount.groups, VoteCount.voters, VoteCount.buyers, VoteCount.shares,
+    ).filter(VoteCount.session_id == session.id, VoteCount.app == app_name)
+    return {treatment: tuple(totals) for treatment, *totals in rows}
+
+
+def admin_report_vars(session, app_name):
+    """Variables of global/SessionMonitor.html."""
+    from common import voting
+
+    if not enabled(session, app_name):
+        return dict(monitor_enabled=False)
+    rows = []
+    for (round_number, role, treatment), (players, cooperators) in sorted(
+        decisions(session, app_name).items(), key=lambda item: (item[0][0], str(item[0][1]), str(item[0][2]))
+    ):
+        rows.append(dict(
+            round_number=round_number,
+            role=role or '',
+            treatment=treatment or '',
+            players=players,
+            cooperators=cooperators,
+            cooperation_rate=f'{cooperators / players:.0%}',
+        ))
+    by_treatment = votes(session, app_name)
+    num_groups = sum(totals[0] for totals in by_treatment.values())
+    treatments = []
+    for name in voting.TREATMENTS:
+        groups = by_treatment.get(name, (0,))[0]
+        treatments.append(dict(name=name, groups=groups, share=f'{groups / num_groups:.0%}' if num_groups else ''))
+    voters, buyers, shares = (sum(totals[k] for totals in by_treatment.values()) for k in (1, 2, 3))
+    return dict(
+        monitor_enabled=True,
+        monitor_decisions=rows,
+        monitor_treatments=treatments,
+        monitor_voters=voters,
+        monitor_buyers=buyers,
+        monitor_shares=shares,
+    )
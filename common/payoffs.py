@@ -0,0 +1,105 @@
+"""
+Payoff tables for the prisoner's dilemma, built once when an app is imported.
+
+The rich (H) and poor (L) matrices of Game A (plain PD) and Game B (PD where
+defecting against a cooperator pays less) are flattened into one tuple of 16
+entries, so resolving a payoff is a single index:
+
+    index = role * 8 + game * 4 + my_choice * 2 + opponent_choice
+
+with role 0 = poor / 1 = rich, game 0 = Game A / 1 = Game B and choices as
+booleans (True = cooperate).
+
+resolve_group() does the same lookup for a whole group at once with NumPy, so
+the ResultsWaitPage callback touches each player row once. NumPy is imported
+on the first call rather than with the apps, see benchmarks/import_time.py.
+"""
+from functools import lru_cache
+
+POOR = 0
+RICH = 1
+
+GAME_A = 0
+GAME_B = 1
+
+
+def _matrix(dd, dc, cd, cc):
+    # ordered by my_choice * 2 + opponent_choice
+    return (dd, dc, cd, cc)
+
+
+def build_payoff_table(C):
+    """Build the flat payoff table from an app's constants."""
+    low_a = _matrix(C.PAYOFF_DD_L, C.PAYOFF_DC_L, C.PAYOFF_CD_L, C.PAYOFF_CC_L)
+    low_b = _matrix(C.PAYOFF_DD_L, C.PAYOFF_DC_COOPERATE_L, C.PAYOFF_CD_L, C.PAYOFF_CC_L)
+    high_a = _matrix(C.PAYOFF_DD_H, C.PAYOFF_DC_H, C.PAYOFF_CD_H, C.PAYOFF_CC_H)
+    high_b = _matrix(C.PAYOFF_DD_H, C.PAYOFF_DC_COOPERATE_H, C.PAYOFF_CD_H, C.PAYOFF_CC_H)
+    return low_a + low_b + high_a + high_b
+
+
+def role_index(player_role):
+    return RICH if player_role == 'rich' else POOR
+
+
+def payoff_index(role, game, my_choice, opponent_choice):
+    """Works on ints and bools, and element-wise on NumPy integer or bool arrays."""
+    return (role << 3) | (game << 2) | (my_choice << 1) | opponent_choice
+
+
+def lookup(table, role, game, my_choice, opponent_choice):
+    return table[payoff_index(role, game, my_choice, opponent_choice)]
+
+
+@lru_cache(maxsize=None)
+def as_array(table):
+    import numpy as np
+
+    return np.array([float(v) for v in table])
+
+
+def resolve_group(table, roles, games, choices, partners, previous_totals=0):
+    """Payoffs and running totals of a whole group in one NumPy pass.
+
+    choices and partners are sequences in player order; roles, games and
+    previous_totals may be sequences in the same order or one value for the
+    whole group.
+    Returns (payoffs, totals) as float arrays.
+    """
+    import numpy as np
+
+    roles = np.asarray(roles, dtype=np.intp)
+    games = np.asarray(games, dtype=np.intp)
+    choices = np.asarray(choices, dtype=np.intp)
+    index = payoff_index(roles, games, choices, choices[np.asarray(partners, dtype=np.intp)])
+    group_payoffs = as_array(table)[index]
+    return group_payoffs, np.asarray(previous_totals, dtype=float) + group_payoffs
+
+
+# (sentence, my choice, partner's choice) in the order the instructions list them
+OUTCOMES = (
+    ('both of you choose Cooperate', True, True),
+    ('you choose Cooperate and your partner chooses Defect', True, False),
+    ('you choose Defect and your partner chooses Cooperate', False, True),
+    ('both of you choose Defect', False, False),
+)
+
+
+@lru_cache(maxsize=None)
+def decision_table(table, role, opponent_role, game):
+    """Template context of the payoff table shown on the decision pages.
+
+    There are only a few variants per app (role x opponent role x game), so
+    each one is built once and shared by every participant who sees it.
+    """
+    def cell(my_choice, opponent_choice):
+        mine = lookup(table, role, game, my_choice, opponent_choice)
+        theirs = lookup(table, opponent_role, game, opponent_choice, my_choice)
+        return dict(mine=mine, theirs=theirs, same=mine == theirs)
+
+    return dict(
+        rows=[
+            dict(choice='Cooperate', value='True', verb='cooperate', cells=[cell(True, True), cell(True, False)]),
+            dict(choice='Defect', value='False', verb='defect', cells=[cell(False, True), cell(False, False)]),
+        ],
+        outcomes=[dict(text=text, **cell(my_choice, opponent_choice)) for text, my_choice, opponent_choice in OUTCOMES],
+    )
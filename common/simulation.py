@@ -0,0 +1,212 @@
+"""
+Offline Monte-Carlo simulation of the experiment, without the oTree server.
+
+Every simulated group goes through the same protocol as a session: roles,
+a new random matching in pairs every round, the part II vote with the
+computer override, and the payoffs from the app's own PAYOFF_TABLE, C and
+the rules in common/core.py. All groups are simulated at once with NumPy
+arrays of shape (groups, players), so a million groups take a few seconds.
+
+Behaviour is given by a strategy profile, one strategy per id_in_group
+slot. Roles are drawn independently of the slots, as in the apps.
+
+    python -m common.simulation asypay_equalvote --profile tit_for_tat
+    python -m common.simulation equalpay_asyvote --profile vote_buying_max --groups 2000000
+    python -m common.simulation equalpay_asyvote --profile vote_buying_max --vote-scheme quadratic
+"""
+import abc
+import argparse
+import importlib
+
+import numpy as np
+
+from common import core, matching, payoffs, voting
+from common.voting import TREATMENTS
+
+
+class Strategy(abc.ABC):
+    """Decisions of one player slot, vectorized over groups."""
+
+    @abc.abstractmethod
+    def cooperate(self, round_number, previous_opponent_choice):
+        """Returns whether each group's player cooperates in round_number."""
+
+    def vote(self, game1_totals, share_limit):
+        """Returns (votes for Game B, additional shares bought)."""
+        return np.zeros(len(game1_totals), dtype=bool), np.zeros(len(game1_totals), dtype=np.int64)
+
+
+class AlwaysDefect(Strategy):
+    def cooperate(self, round_number, previous_opponent_choice):
+        return np.zeros(len(previous_opponent_choice), dtype=bool)
+
+
+class AlwaysCooperate(Strategy):
+    def cooperate(self, round_number, previous_opponent_choice):
+        return np.ones(len(previous_opponent_choice), dtype=bool)
+
+    def vote(self, game1_totals, share_limit):
+        return np.ones(len(game1_totals), dtype=bool), np.zeros(len(game1_totals), dtype=np.int64)
+
+
+class TitForTat(AlwaysCooperate):
+    """Cooperates in round 1, then repeats what the previous partner did."""
+
+    def cooperate(self, round_number, previous_opponent_choice):
+        if round_number == 1:
+            return np.ones(len(previous_opponent_choice), dtype=bool)
+        return previous_opponent_choice.copy()
+
+
+class VoteBuyer(Strategy):
+    """Plays like `play` and votes for Game B, buying `shares` additional
+    shares (or as many as allowed if shares is None)."""
+
+    def __init__(self, shares, play=None):
+        self.shares = shares
+        self.play = play or TitForTat()
+
+    def cooperate(self, round_number, previous_opponent_choice):
+        return self.play.cooperate(round_number, previous_opponent_choice)
+
+    def vote(self, game1_totals, share_limit):
+        if self.shares is None:
+            shares = share_limit
+        else:
+            shares = np.minimum(self.shares, share_limit)
+        return np.ones(len(game1_totals), dtype=bool), shares
+
+
+PROFILES = {
+    'always_defect': [AlwaysDefect()] * 4,
+    'always_cooperate': [AlwaysCooperate()] * 4,
+    'tit_for_tat': [TitForTat()] * 4,
+    'vote_buying_1': [VoteBuyer(1)] * 2 + [AlwaysDefect()] * 2,
+    'vote_buying_5': [VoteBuyer(5)] * 2 + [AlwaysDefect()] * 2,
+    'vote_buying_max': [VoteBuyer(None)] * 2 + [AlwaysDefect()] * 2,
+}
+
+
+class AppRules:
+    """The parts of an app that the simulation needs, read from its module."""
+
+    def __init__(self, app_name, vote_scheme=None):
+        app = importlib.import_module(app_name)
+        C = app.C
+        self.name = app_name
+        self.num_rounds = C.NUM_ROUNDS
+        self.vote_round = C.VOTE_ROUND
+        self.cost_voting = float(C.COST_VOTING)
+        self.table = payoffs.as_array(app.PAYOFF_TABLE)
+        self.buys_shares = core.buys_shares(C)
+        self.vote_scheme = vote_scheme or C.VOTE_SCHEME
+        core.check_vote_scheme(self.vote_scheme, C) #the same schemes as creating_session allows
+        self.num_rich = C.NUM_RICH
+        self.part2_game = np.array([core.part2_game(t) for t in TREATMENTS], dtype=np.intp)
+        self.charges_vote_cost = np.array([self.buys_shares and core.charges_vote_cost(t) for t in TREATMENTS])
+
+
+def simulate(rules: AppRules, profile, num_groups, rng):
+    group_size = len(profile)
+    rows = np.arange(num_groups)[:, None]
+    roles = np.zeros((num_groups, group_size), dtype=np.intp)
+    if rules.num_rich:
+        rich = np.argsort(rng.random((num_groups, group_size)), axis=1)[:, : rules.num_rich]
+        np.put_along_axis(roles, rich, payoffs.RICH, axis=1)
+
+    game1 = np.zeros((num_groups, group_size))
+    game2 = np.zeros((num_groups, group_size))
+    shares = np.zeros((num_groups, group_size), dtype=np.int64)
+    treatment = np.full(num_groups, -1)
+    game = np.full((num_groups, 1), payoffs.GAME_A)
+    previous_opponent_choice = np.zeros((num_groups, group_size), dtype=bool)
+
+    for round_number in range(1, rules.num_rounds + 1):
+        if round_number == rules.vote_round:
+            votes = np.zeros((num_groups, group_size), dtype=bool)
+            share_limit = (game1 // rules.cost_voting).astype(np.int64)
+            for slot, strategy in enumerate(profile):
+                votes[:, slot], shares[:, slot] = strategy.vote(game1[:, slot], share_limit[:, slot])
+            if not rules.buys_shares:
+                shares[:] = 0
+            # the same coin flips as creating_session draws for a session
+            coin_flips = voting.encode_coin_flips(rng.random((num_groups, 2)) < 0.5)
+            treatment = voting.tally(rules.vote_scheme, votes, shares, coin_flips).treatment
+            game = rules.part2_game[treatment][:, None]
+
+        choices = np.empty((num_groups, group_size), dtype=bool)
+        for slot, strategy in enumerate(profile):
+            choices[:, slot] = strategy.cooperate(round_number, previous_opponent_choice[:, slot])
+        _, partners = matching.random_pairs(rng, (num_groups,), group_size)
+        opponent_choice = choices[rows, partners]
+        index = payoffs.payoff_index(roles, game, choices.astype(np.intp), opponent_choice)
+        if round_number < rules.vote_round:
+            game1 += rules.table[index]
+        else:
+            game2 += rules.table[index]
+        previous_opponent_choice = opponent_choice
+
+    cost = shares * rules.cost_voting * rules.charges_vote_cost[treatment][:, None]
+    return dict(roles=roles, treatment=treatment, shares=shares, final=game1 + game2 - cost)
+
+
+def report(rules, profile_name, result, session_size, per_point, participation_fee):
+    final, roles, treatment = result['final'], result['roles'], result['treatment']
+    num_groups, group_size = final.shape
+    print(f'{rules.name}, profile {profile_name}, {rules.vote_scheme} vote, {num_groups} groups')
+    print(f"{'treatment':<10}{'groups':>9}{'rich mean':>11}{'poor mean':>11}")
+    for code, name in enumerate(TREATMENTS):
+        in_treatment = treatment == code
+        row = f'{name:<10}{in_treatment.mean():>9.1%}'
+        for role in (payoffs.RICH, payoffs.POOR):
+            values = final[in_treatment[:, None] & (roles == role)]
+            row += f'{values.mean():>11.1f}' if values.size else f"{'-':>11}"
+        print(row)
+
+    p5, p50, p95 = np.percentile(final, [5, 50, 95])
+    print(f'final payoff (points): mean {final.mean():.1f}, sd {final.std():.1f}, p5 {p5:.0f}, p50 {p50:.0f}, p95 {p95:.0f}')
+
+    groups_per_session = max(1, session_size // group_size)
+    num_sessions = num_groups // groups_per_session
+    if not num_sessions:
+        print(f'budget per session: needs at least {groups_per_session} groups (--groups)')
+        return
+    group_totals = final.sum(axis=1)[: num_sessions * groups_per_session]
+    session_points = group_totals.reshape(num_sessions, groups_per_session).sum(axis=1)
+    session_budget = session_points * per_point + groups_per_session * group_size * participation_fee
+    print(
+        f'budget per {groups_per_session * group_size}-participant session: '
+        f'mean {session_budget.mean():.2f}, p95 {np.percentile(session_budget, 95):.2f}, '
+        f'max {session_budget.max():.2f}'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('app_name')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='tit_for_tat')
+    parser.add_argument('--groups', type=int, default=1_000_000)
+    parser.add_argument('--session-size', type=int, default=400, help='participants per session, for the budget')
+    parser.add_argument('--vote-scheme', choices=sorted(voting.SCHEMES), help="the app's C.VOTE_SCHEME if omitted")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    from settings import SESSION_CONFIG_DEFAULTS
+
+    try:
+        rules = AppRules(args.app_name, args.vote_scheme)
+    except ValueError as exc:
+        parser.error(str(exc))
+    result = simulate(rules, PROFILES[args.profile], args.groups, np.random.default_rng(args.seed))
+    report(
+        rules,
+        args.profile,
+        result,
+        args.session_size,
+        SESSION_CONFIG_DEFAULTS['real_world_currency_per_point'],
+        SESSION_CONFIG_DEFAULTS['participation_fee'],
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Tally of the part II vote, for any number of groups in one NumPy call.
+
+Every player has one share and may buy additional ones at C.COST_VOTING
+each. A scheme turns the shares into vote weights:
+
+    equal      one vote per player, purchased shares do not count
+    shares     one vote per share (equalpay_asyvote)
+    quadratic  the square root of the shares, so the n-th vote costs
+               about 2n - 1 shares
+
+More schemes can be added to SCHEMES as functions from the (groups, players)
+array of purchased shares to vote weights.
+
+tally() gets the votes and purchases of all groups as (groups, players)
+arrays plus the coin flips drawn in creating_session, and returns the
+treatment of every group. assign_treatment() in core.py calls it with the
+one group whose VoteWaitPage just completed; the offline simulation calls
+it with a million groups at once.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+TREATMENTS = ('EndoYes', 'EndoNo', 'ExoYes', 'ExoNo')
+ENDO_YES, ENDO_NO, EXO_YES, EXO_NO = range(4)
+
+# bits of the coin flips drawn for each group in creating_session
+OVERRIDE = 1 #the computer overrides the group decision
+DICE = 2 #ExoYes if overridden, EndoYes if the vote is a tie
+
+
+def encode_coin_flips(flips):
+    """(groups, 2) booleans -> OVERRIDE/DICE bit masks, one per group."""
+    return flips[:, 0] * OVERRIDE | flips[:, 1] * DICE
+
+
+def equal(shares):
+    return np.ones(shares.shape)
+
+
+def purchased_shares(shares):
+    return 1.0 + shares
+
+
+def quadratic(shares):
+    return np.sqrt(1.0 + shares)
+
+
+SCHEMES = dict(equal=equal, shares=purchased_shares, quadratic=quadratic)
+
+Tally = namedtuple('Tally', ['treatment', 'votes_for', 'votes', 'override', 'tie', 'dice'])
+
+
+def tally(scheme, votes, shares, coin_flips):
+    """Treatment code of every group, see TREATMENTS.
+
+    votes are the players' votes for Game B, shares the additional shares
+    they bought, both (groups, players); coin_flips has one OVERRIDE/DICE
+    bit mask per group. Raises ValueError if a share count is negative.
+    """
+    shares = np.asarray(shares)
+    if (shares < 0).any():
+        # a negative purchase would lower the cost paid, and is NaN under quadratic voting
+        raise ValueError('additional shares cannot be negative')
+    weights = SCHEMES[scheme](shares)
+    votes_for = (np.asarray(votes, dtype=bool) * weights).sum(axis=-1)
+    total = weights.sum(axis=-1)
+    coin_flips = np.asarray(coin_flips)
+    override = (coin_flips & OVERRIDE).astype(bool)
+    dice = (coin_flips & DICE).astype(bool)
+    # weights are not integers under quadratic voting
+    tie = np.isclose(2 * votes_for, total)
+    treatment = np.where(2 * votes_for > total, ENDO_YES, ENDO_NO)
+    treatment = np.where(tie, np.where(dice, ENDO_YES, ENDO_NO), treatment)
+    treatment = np.where(override, np.where(dice, EXO_YES, EXO_NO), treatment)
+    return Tally(treatment, votes_for, total, override, tie & ~override, dice)
@@ -0,0 +1,58 @@
+from otree.api import Currency as cu, currency_range, expect, Bot, SubmissionMustFail
+from . import *
+from common import bots
+
+
+class PlayerBot(Bot):
+    # cooperate: everyone cooperates, votes for Game B and buys as many shares as allowed
+    # defect: everyone defects, votes against Game B and buys no shares
+    # mixed: even ids cooperate and vote for Game B, everyone buys one share
+    cases = ['cooperate', 'defect', 'mixed']
+
+    def play_round(self):
+        # self.player is only read after the ResultsWaitPage: the bot keeps the
+        # first copy of a player it loads, so reading it earlier gives stale payoffs
+        round_number = self.subsession.round_number
+        cooperate = bots.wants_to_cooperate(self.case, self.participant)
+
+        if round_number == 1:
+            yield Introduction
+            yield Game1Instructions
+        if round_number < C.VOTE_ROUND:
+            yield from bots.decide(self, Decision, PairWaitPage, cooperate)
+        if round_number == C.VOTE_ROUND:
+            game1_rounds = round(C.VOTE_ROUND - 1)
+            # nobody can earn more than PAYOFF_DC_L per round in part I
+            yield VoteForGame2Instructions
+            yield SubmissionMustFail(
+                Vote, dict(if_vote=cooperate, additional_vote_share=game1_rounds * C.PAYOFF_DC_L // C.COST_VOTING + 1)
+            )
+            yield SubmissionMustFail(Vote, dict(if_vote=cooperate, additional_vote_share=-1))
+            if self.case == 'cooperate':
+                shares = game1_rounds * C.PAYOFF_CC_L // C.COST_VOTING
+            elif self.case == 'defect':
+                shares = 0
+            else:
+                shares = 1
+            yield Vote, dict(if_vote=cooperate, additional_vote_share=int(shares))
+            yield VoteResult
+            yield Game2Instructions
+        if round_number >= C.VOTE_ROUND:
+            yield from bots.decide(self, DecisionAfterVote, PairWaitPage, cooperate)
+
+        player = self.player
+        if self.case == 'cooperate':
+            expect(player.payoff, C.PAYOFF_CC_L)
+        if self.case == 'defect':
+            expect(player.payoff, C.PAYOFF_DD_L)
+        expect(player.my_choice, player.field_display('cooperate'))
+        yield Results
+
+        if round_number == C.NUM_ROUNDS:
+            # purchased shares are paid for unless the computer overrode the vote (Exo treatments)
+            cost = player.in_round(C.VOTE_ROUND).additional_vote_share * C.COST_VOTING
+            if player.group.treatment in ('ExoYes', 'ExoNo'):
+                cost = 0
+            expect(player.final_payoff, sum(p.payoff for p in player.in_all_rounds()) - cost)
+            yield Summary
+
@@ -18,12 +18,64 @@ SESSION_CONFIGS = [
         display_name="asy pay equal vote",
         app_sequence=['asypay_equalvote'],
         num_demo_participants=4,
+        players_per_group=4,
+        rich_per_group=2,
+        pairing='random',
     ),
     dict(
         name='equalpay_asyvote',
         display_name="equal pay asy vote",
         app_sequence=['equalpay_asyvote'],
         num_demo_participants=4,
+        players_per_group=4,
+        pairing='random',
+    ),
+    dict(
+        name='asypay_equalvote_pairs',
+        display_name="asy pay equal vote (pairs wait for themselves)",
+        app_sequence=['asypay_equalvote'],
+        num_demo_participants=4,
+        players_per_group=4,
+        rich_per_group=2,
+        pairing='random',
+        sync='pair',
+    ),
+    dict(
+        name='asypay_equalvote_live',
+        display_name="asy pay equal vote (live decisions)",
+        app_sequence=['asypay_equalvote'],
+        num_demo_participants=4,
+        players_per_group=4,
+        rich_per_group=2,
+        pairing='random',
+        live_decisions=True,
+    ),
+    dict(
+        name='equalpay_asyvote_quadratic',
+        display_name="equal pay asy vote (quadratic voting)",
+        app_sequence=['equalpay_asyvote'],
+        num_demo_participants=4,
+        players_per_group=4,
+        pairing='random',
+        vote_scheme='quadratic',
+    ),
+    dict(
+        name='equalpay_asyvote_pairs',
+        display_name="equal pay asy vote (pairs wait for themselves)",
+        app_sequence=['equalpay_asyvote'],
+        num_demo_participants=4,
+        players_per_group=4,
+        pairing='random',
+        sync='pair',
+    ),
+    dict(
+        name='equalpay_asyvote_live',
+        display_name="equal pay asy vote (live decisions)",
+        app_sequence=['equalpay_asyvote'],
+        num_demo_participants=4,
+        players_per_group=4,
+        pairing='random',
+        live_decisions=True,
     ),
 ]
 
@@ -31,13 +83,30 @@ SESSION_CONFIGS = [
 # in SESSION_CONFIGS, except those that explicitly override it.
 # the session config can be accessed from methods in your apps as self.session.config,
 # e.g. self.session.config['participation_fee']
+# players_per_group (any even number), rich_per_group and pairing ('random' or
+# 'fixed') set the group layout of the treatment apps, see common/core.py.
+# random_seed (an integer) makes a session reproducible; without it a seed is
+# drawn and saved in session.random_seed
+# vote_scheme ('shares' or 'quadratic') sets how purchased shares count in
+# equalpay_asyvote's vote, see common/voting.py
+# sync='pair' lets each pair go on to Results as soon as both partners have
+# chosen, instead of waiting for the whole group on ResultsWaitPage;
+# live_decisions=True does the same with the choices sent over a live channel
 
 SESSION_CONFIG_DEFAULTS = dict(
     real_world_currency_per_point=1.00, participation_fee=0.00, doc=""
 )
 
-PARTICIPANT_FIELDS = []
-SESSION_FIELDS = []
+PARTICIPANT_FIELDS = [
+    'cum_payoff_game1',  # running totals, updated in set_payoffs
+    'cum_payoff_game2',
+    'additional_vote_share',  # shares bought in the vote round (equalpay_asyvote)
+    'history',  # one tuple per played round, see common/history.py
+]
+SESSION_FIELDS = [
+    'random_seed',  # seed of all draws in the session, see common/core.py
+    'monitor',  # apps whose counts are kept for the admin report, see common/monitor.py
+]
 
 # ISO-639 code
 # for example: de, fr, ja, ko, zh-hans